@@ -92,6 +92,17 @@ DATABASES = {
     }
 }
 
+# Cache shared between the web workers and the ingestion_worker / crawl_catalog processes, which publish catalog
+# change sets and album stamps through it (the catalog version itself is a database counter). The table of the
+# database default is created by `migrate`, point CACHE_BACKEND at memcached/redis in production. A per-process
+# LocMemCache is refused by those commands
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.getenv("CACHE_LOCATION", 'django_cache'),
+    }
+}
+
 REST_FRAMEWORK = {'DEFAULT_AUTHENTICATION_CLASSES': (
                       'rest_framework_simplejwt.authentication.JWTAuthentication',
                   )
@@ -163,6 +174,48 @@ SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 SPOTIFY_BASE_URL = os.getenv("SPOTIFY_BASE_URL")
 SPOTIFY_AUTH_URL = os.getenv("SPOTIFY_AUTH_URL")
 
+# Spotify http client configurations
+SPOTIFY_TIMEOUT = int(os.getenv("SPOTIFY_TIMEOUT", 30))
+SPOTIFY_POOL_SIZE = int(os.getenv("SPOTIFY_POOL_SIZE", 10))
+SPOTIFY_MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", 5))
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", 10))
+SPOTIFY_RATE_BURST = int(os.getenv("SPOTIFY_RATE_BURST", 20))
+SPOTIFY_MAX_WORKERS = int(os.getenv("SPOTIFY_MAX_WORKERS", SPOTIFY_POOL_SIZE))
+
+# On-disk Spotify response cache under the user cache directory, an empty SPOTIFY_CACHE_DIR disables it.
+# Ttls are in seconds per api path, entries past the longest ttl and beyond SPOTIFY_CACHE_MAX_BYTES are pruned
+SPOTIFY_CACHE_DIR = os.getenv("SPOTIFY_CACHE_DIR", os.path.join(
+    os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "musicproj", "spotify"))
+SPOTIFY_CACHE_MAX_BYTES = int(os.getenv("SPOTIFY_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+SPOTIFY_CACHE_TTLS = {
+    'artists/': int(os.getenv("SPOTIFY_CACHE_ARTIST_TTL", 7 * 24 * 3600)),
+    'albums/': int(os.getenv("SPOTIFY_CACHE_ALBUM_TTL", 24 * 3600)),
+    'browse/new-releases/': int(os.getenv("SPOTIFY_CACHE_NEW_RELEASES_TTL", 3600)),
+}
+
+# Number of rows written per statement by the ingestion persistence stage
+INGESTION_BATCH_SIZE = int(os.getenv("INGESTION_BATCH_SIZE", 500))
+
+# "inline" ingests missing pages inside the request, "queue" leaves them to the ingestion_worker command
+INGESTION_MODE = os.getenv("INGESTION_MODE", "inline")
+INGESTION_JOB_TIMEOUT = int(os.getenv("INGESTION_JOB_TIMEOUT", 600))
+INGESTION_RETRY_DELAY = int(os.getenv("INGESTION_RETRY_DELAY", 30))
+# Seconds between the locked_at renewals of a running job, well under INGESTION_JOB_TIMEOUT
+INGESTION_HEARTBEAT_INTERVAL = int(os.getenv("INGESTION_HEARTBEAT_INTERVAL", max(INGESTION_JOB_TIMEOUT // 3, 1)))
+
+# Seconds a rendered fetch-tracks page stays cached, pages are also dropped whenever ingestion stores new data
+PAGE_CACHE_TIMEOUT = int(os.getenv("PAGE_CACHE_TIMEOUT", 3600))
+# Seconds the ids written by an ingestion step are kept for the in-memory indexes to replay
+CATALOG_CHANGES_TIMEOUT = int(os.getenv("CATALOG_CHANGES_TIMEOUT", 24 * 3600))
+# Build the in-memory catalog indexes in the background when a worker starts
+TYPEAHEAD_PRELOAD = os.getenv("TYPEAHEAD_PRELOAD", "true").lower() == "true"
+# Seconds between two checks of the in-memory indexes for catalog and playlist changes
+CATALOG_INDEX_REFRESH_INTERVAL = float(os.getenv("CATALOG_INDEX_REFRESH_INTERVAL", 5))
+
+# Full catalog crawl configurations
+CRAWL_CHUNK_SIZE = int(os.getenv("CRAWL_CHUNK_SIZE", 20))
+CRAWL_ARTIST_CACHE_SIZE = int(os.getenv("CRAWL_ARTIST_CACHE_SIZE", 10000))
+
 AUTH_USER_MODEL = 'authentication.User'
 
 EMAIL_USE_TLS = True
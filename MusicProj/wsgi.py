@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MusicProj.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings
+
+if settings.TYPEAHEAD_PRELOAD:
+    from musicapp.indexes import warm_indexes
+    warm_indexes()
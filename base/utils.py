@@ -1,4 +1,6 @@
 
+import base64, binascii, json
+
 # django imports
 from django.core.paginator import EmptyPage
 from django.core.mail import send_mail
@@ -82,4 +84,33 @@ def send_mail_request(recipient, mail_txt, mail_html, subject, **kwargs):
                 }
     msg_text = render_to_string(mail_txt, mail_dict)
     msg_html = render_to_string(mail_html, mail_dict)          
-    send_mail(subject, msg_text, FROM, TO, html_message=msg_html, fail_silently=False)
\ No newline at end of file
+    send_mail(subject, msg_text, FROM, TO, html_message=msg_html, fail_silently=False)
+
+
+def chunked(items, size):
+    ''' Split a list into consecutive chunks of at most `size` items '''
+    return [items[index:index + size] for index in range(0, len(items), size)]
+
+
+def encode_cursor(value):
+    """
+    This method wraps a keyset position into an opaque url safe cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    This method reads back the keyset position of a cursor made by encode_cursor.
+    """
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except (ValueError, UnicodeError, binascii.Error):
+        raise ValidationError("Invalid cursor")
+
+
+def is_compact(request):
+    """
+    This method tells whether the client asked for the compact, side loaded response format.
+    """
+    return request.GET.get("compact", "").lower() in ("1", "true", "yes")
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MusicappConfig(AppConfig):
     name = 'musicapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
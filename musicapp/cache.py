@@ -0,0 +1,124 @@
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from .constants import *
+from .models import CatalogCounter
+from MusicProj.settings import PAGE_CACHE_TIMEOUT, CATALOG_CHANGES_TIMEOUT
+
+
+# catalog version bumped by ingestion whenever it persists new data, with the ids it wrote. The version itself
+# is a database counter, the change sets and album stamps it keys live in the shared cache. Cached pages
+# remember the write stamp of every album they contain and are only dropped when one of those albums changes,
+# or when new albums shift the pages around
+class CatalogCache:
+    @classmethod
+    def require_shared_backend(cls):
+        ''' Writers running in their own process publish versions through the cache, a per-process backend would
+            keep them from ever reaching the web workers
+        '''
+        # `cache` is a proxy, the backend class is on the resolved default cache
+        backend = caches["default"]
+        if isinstance(backend, (LocMemCache, DummyCache)):
+            raise ImproperlyConfigured("CACHE_BACKEND {} is not shared between processes, catalog changes written "
+                                       "here would never reach the web workers".format(type(backend).__name__))
+
+    @classmethod
+    def get_version(cls, name=CATALOG_VERSION_KEY):
+        version = CatalogCounter.objects.filter(name=name).values_list("value", flat=True).first()
+        return 1 if version is None else version
+
+    @classmethod
+    def next_version(cls, name=CATALOG_VERSION_KEY):
+        ''' Increment a version in one statement, concurrent writers never share a version. Cache backends
+            only offer an atomic incr on memcached and redis, the database cache does a get and a set
+        '''
+        with connection.cursor() as cursor:
+            cursor.execute("""INSERT INTO {table} (name, value) VALUES (%s, 2)
+                ON CONFLICT (name) DO UPDATE SET value = {table}.value + 1 RETURNING value""".format(
+                    table=CatalogCounter._meta.db_table), [name])
+            return cursor.fetchone()[0]
+
+    @classmethod
+    def get_membership(cls):
+        return cache.get(CATALOG_MEMBERSHIP_KEY, 0)
+
+    @classmethod
+    def bump_version(cls, changes=None):
+        ''' Move the catalog to a new version. `changes` maps "tracks", "albums" and "artists" to the ids written,
+            in-memory indexes replay them, cached pages holding one of the "albums" stop being served.
+            "new_albums" lists the albums that didn't exist before, they invalidate every page
+        '''
+        version = cls.next_version()
+
+        if changes is not None:
+            cache.set(CATALOG_CHANGES_KEY.format(version=version), changes, timeout=CATALOG_CHANGES_TIMEOUT)
+            cache.set_many({CATALOG_ALBUM_STAMP_KEY.format(album_id=album_id): version
+                                for album_id in changes.get("albums", [])}, timeout=CATALOG_CHANGES_TIMEOUT)
+            # the membership only has to differ from what cached pages saw, a unique version always does
+            if changes.get("new_albums"):
+                cache.set(CATALOG_MEMBERSHIP_KEY, version, timeout=None)
+        return version
+
+    @classmethod
+    def bump_weights(cls, track_ids):
+        ''' Publish tracks whose playlist membership changed on their own channel, playlist traffic doesn't move
+            the catalog version and can't push ingestion changes out of the replay window
+        '''
+        version = cls.next_version(CATALOG_WEIGHTS_KEY)
+        cache.set(CATALOG_WEIGHTS_CHANGES_KEY.format(version=version), {"tracks": list(track_ids)},
+                  timeout=CATALOG_CHANGES_TIMEOUT)
+        return version
+
+    @classmethod
+    def album_stamps(cls, album_ids):
+        ''' The version of the last write to each album, 0 when unknown '''
+        keys = {album_id: CATALOG_ALBUM_STAMP_KEY.format(album_id=album_id) for album_id in album_ids}
+        stamps = cache.get_many(list(keys.values()))
+        return {album_id: stamps.get(key, 0) for album_id, key in keys.items()}
+
+    @classmethod
+    def get_changes(cls, from_version, to_version, key=CATALOG_CHANGES_KEY):
+        ''' Merge the ids changed after from_version up to to_version, None when any change set is unknown '''
+        if to_version - from_version > CATALOG_MAX_REPLAYED_VERSIONS:
+            return None
+
+        keys = [key.format(version=version) for version in range(from_version + 1, to_version + 1)]
+        change_sets = cache.get_many(keys)
+        if len(change_sets) != len(keys):
+            return None
+
+        merged = {}
+        for changes in change_sets.values():
+            for kind, ids in changes.items():
+                merged.setdefault(kind, set()).update(ids)
+        return merged
+
+    @classmethod
+    def page_key(cls, name, **params):
+        query = "&".join("{}={}".format(key, params[key]) for key in sorted(params))
+        return "catalog:page:{}:{}".format(name, query)
+
+    @classmethod
+    def page_stamp(cls):
+        ''' Read before rendering a page, so writes landing while it renders are never cached as fresh '''
+        return cls.get_version(), cls.get_membership()
+
+    @classmethod
+    def get_page(cls, key):
+        entry = cache.get(key)
+        if entry is None or entry["membership"] != cls.get_membership():
+            return None
+        if cls.album_stamps(entry["albums"]) != entry["albums"]:
+            return None
+        return entry["content"]
+
+    @classmethod
+    def set_page(cls, key, content, album_ids, stamp):
+        version, membership = stamp
+        stamps = cls.album_stamps(album_ids)
+        # an album written after rendering started may be missing from the content
+        if any(album_stamp > version for album_stamp in stamps.values()):
+            return
+        cache.set(key, {"content": content, "albums": stamps, "membership": membership}, timeout=PAGE_CACHE_TIMEOUT)
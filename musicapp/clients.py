@@ -0,0 +1,238 @@
+import json, random, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from .exceptions import *
+from .constants import *
+from .http_cache import ResponseCache
+from MusicProj.settings import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_TIMEOUT, SPOTIFY_POOL_SIZE, SPOTIFY_MAX_RETRIES, \
+                    SPOTIFY_RATE_LIMIT, SPOTIFY_RATE_BURST, SPOTIFY_CACHE_DIR, SPOTIFY_CACHE_TTLS, SPOTIFY_CACHE_MAX_BYTES
+
+
+def configured_url(url, setting):
+    ''' An explicitly given url, else the named setting read at call time '''
+    url = url or getattr(settings, setting, None)
+    if not url:
+        raise ImproperlyConfigured("{} is not set".format(setting))
+    return url
+
+
+class TokenBucket:
+    """A thread safe token bucket limiting the rate of outgoing requests"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        ''' Block until a token is available and consume it '''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        ''' Stop handing out tokens for `seconds`, as asked by a Retry-After header '''
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+# client keeping pooled keep-alive connections to Spotify and pacing the requests sent to it
+class SpotifyClient:
+    def __init__(self, base_url=None, timeout=SPOTIFY_TIMEOUT, pool_size=SPOTIFY_POOL_SIZE,
+                    max_retries=SPOTIFY_MAX_RETRIES, rate=SPOTIFY_RATE_LIMIT, burst=SPOTIFY_RATE_BURST,
+                    cache_dir=SPOTIFY_CACHE_DIR):
+        # None falls back to settings.SPOTIFY_BASE_URL on every request
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.limiter = TokenBucket(rate, burst)
+
+        # pool_block caps the number of open connections per host at pool_size
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.cache = ResponseCache(cache_dir, ttls=SPOTIFY_CACHE_TTLS, max_bytes=SPOTIFY_CACHE_MAX_BYTES) if cache_dir else None
+
+    def backoff(self, attempt):
+        ''' Exponential backoff with full jitter '''
+        return random.uniform(0, min(SPOTIFY_BACKOFF_CAP, SPOTIFY_BACKOFF_BASE * (2 ** attempt)))
+
+    def retry_after(self, response, attempt):
+        try:
+            return float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return self.backoff(attempt)
+
+    def request(self, method, request_url, headers={}, querystring={}, data={}):
+        ''' Send a request through the pooled session, retrying connection errors, 429 and 5xx responses '''
+        if not request_url.startswith(("http://", "https://")):
+            request_url = configured_url(self.base_url, "SPOTIFY_BASE_URL") + request_url
+
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self.session.request(method, request_url, headers=headers, \
+                                params=querystring, data=data, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise ThirdPartyError(SPOTIFY_CONNECTION_ERROR)
+                time.sleep(self.backoff(attempt))
+                continue
+
+            if response.status_code == 429:
+                # every thread sharing the client waits out the window Spotify asked for
+                self.limiter.pause(self.retry_after(response, attempt))
+            elif response.status_code >= 500:
+                # no point waiting after the last attempt, the error response is returned right away
+                if attempt < self.max_retries:
+                    time.sleep(self.backoff(attempt))
+            else:
+                return response
+
+        return response
+
+    def cached_response(self, request_url, entry):
+        ''' Rebuild a response from a cache entry so callers can't tell it from a network one '''
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry.get("url", request_url)
+        response._content = json.dumps(entry["body"]).encode("utf-8")
+        response.headers["Content-Type"] = "application/json"
+        response.encoding = "utf-8"
+        return response
+
+    def get(self, request_url, headers={}, querystring={}, cached=True):
+        ''' GET through the response cache: fresh entries are served locally, stale ones are revalidated
+            with If-None-Match / If-Modified-Since so an unchanged body costs a 304 without payload.
+            cached=False bypasses it, for responses whose parts the caller caches individually
+        '''
+        if self.cache is None or not cached:
+            return self.request('GET', request_url, headers, querystring)
+
+        base_url = configured_url(self.base_url, "SPOTIFY_BASE_URL")
+        path = request_url[len(base_url):] if request_url.startswith(base_url) else request_url
+        key = self.cache.key(path, querystring)
+        entry = self.cache.load(key)
+        if entry and self.cache.is_fresh(entry):
+            return self.cached_response(request_url, entry)
+
+        request_headers = dict(headers)
+        if entry and entry.get("etag"):
+            request_headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            request_headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = self.request('GET', request_url, request_headers, querystring)
+        if response.status_code == 304 and entry:
+            self.cache.touch(key, entry, self.cache.ttl_for(path))
+            return self.cached_response(request_url, entry)
+
+        if response.status_code == 200:
+            try:
+                body = response.json()
+            except ValueError:
+                return response
+            self.cache.store(key, {"url": response.url, "body": body, "etag": response.headers.get("ETag"),
+                                    "last_modified": response.headers.get("Last-Modified"),
+                                    "stored_at": time.time(), "ttl": self.cache.ttl_for(path)})
+        return response
+
+    def post(self, request_url, headers={}, data={}):
+        return self.request('POST', request_url, headers, data=data)
+
+    def paginate(self, request_url, headers={}, querystring={}, items_key=None):
+        ''' Yield (page_url, page) for every page of a paging object, following its `next` cursor.
+            items_key names the paging object inside the body, e.g. "albums" for browse/new-releases.
+            headers may be a callable, it is then called for every page so long crawls pick up refreshed tokens
+        '''
+        while request_url:
+            response = self.get(request_url, headers() if callable(headers) else headers, querystring)
+            if response.status_code != 200:
+                raise ThirdPartyError(SONG_FETCH_ERROR)
+
+            page = response.json()
+            paging = page.get(items_key) if items_key else page
+            yield response.url, paging
+
+            # `next` already carries the query string of the following page
+            request_url, querystring = paging.get("next"), {}
+
+
+spotify_client = SpotifyClient()
+
+
+# process wide provider of the client-credentials token, shared between workers through the django cache
+class SpotifyTokenProvider:
+    def __init__(self, client, auth_url=None, refresh_margin=SPOTIFY_TOKEN_REFRESH_MARGIN):
+        self.client = client
+        self.auth_url = auth_url
+        self.refresh_margin = refresh_margin
+        self.access_token = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+
+    def is_fresh(self):
+        return self.access_token is not None and time.time() < self.expires_at
+
+    def request_token(self):
+        auth_response = self.client.post(configured_url(self.auth_url, "SPOTIFY_AUTH_URL"), data={
+                    'grant_type': 'client_credentials',
+                    'client_id': SPOTIFY_CLIENT_ID,
+                    'client_secret': SPOTIFY_CLIENT_SECRET,
+                })
+        if auth_response.status_code != 200:
+            raise ThirdPartyError(SPOTIFY_AUTH_ERROR)
+
+        auth_response_data = auth_response.json()
+        # refresh a little before Spotify expires the token
+        lifetime = max(int(auth_response_data.get('expires_in', 3600)) - self.refresh_margin, 0)
+        return auth_response_data['access_token'], time.time() + lifetime
+
+    def get_token(self):
+        ''' Return a valid access token, refreshing it under the lock so concurrent callers don't stampede '''
+        if self.is_fresh():
+            return self.access_token
+
+        with self.lock:
+            if self.is_fresh():
+                return self.access_token
+
+            shared = cache.get(SPOTIFY_TOKEN_CACHE_KEY)
+            if shared and shared.get('expires_at', 0) > time.time():
+                self.access_token, self.expires_at = shared['access_token'], shared['expires_at']
+                return self.access_token
+
+            self.access_token, self.expires_at = self.request_token()
+            cache.set(SPOTIFY_TOKEN_CACHE_KEY, {'access_token': self.access_token, 'expires_at': self.expires_at},
+                        timeout=max(int(self.expires_at - time.time()), 1))
+            return self.access_token
+
+    def invalidate(self):
+        with self.lock:
+            self.access_token, self.expires_at = None, 0.0
+            cache.delete(SPOTIFY_TOKEN_CACHE_KEY)
+
+    def get_headers(self):
+        return {
+            'Authorization': 'Bearer {token}'.format(token=self.get_token())
+        }
+
+
+token_provider = SpotifyTokenProvider(spotify_client)
@@ -1,7 +1,52 @@
 GENERIC_ERR= "Something went wrong"
 SONG_FETCH_ERROR = "Can't connect to Spotify Api"
 ALBUM_FIELDS = ['id', 'album_type', 'name', 'release_date', 'artists', 'total_tracks', 'external_urls']
+TRACK_FIELDS = ['id', 'name', 'duration_ms', 'artists', 'genres', 'external_urls']
 PAGE_FIELDS = ["limit", "next","offset", "previous"]
 PAGINATION_ERR = "Please enter offset values in multiples of the limit(20)"
 API_ERROR = "Error in albums save operation"
 SONG_FETCH_ERROR = "Error in songs save operation"
+ARTIST_BATCH_SIZE = 50
+SPOTIFY_CONNECTION_ERROR = "Can't connect to Spotify Api"
+SPOTIFY_BACKOFF_BASE = 0.5
+SPOTIFY_BACKOFF_CAP = 30
+SPOTIFY_AUTH_ERROR = "Can't authenticate with Spotify Api"
+SPOTIFY_TOKEN_CACHE_KEY = "spotify:access-token"
+SPOTIFY_TOKEN_REFRESH_MARGIN = 60
+ALBUM_TRACKS_PAGE_LIMIT = 50
+NEW_RELEASES_PAGE_LIMIT = 50
+MAX_CURSOR_LIMIT = 100
+CURSOR_LIMIT_ERR = "Please enter a limit between 1 and 100"
+CATALOG_VERSION_KEY = "catalog:version"
+SEARCH_CONFIG = "simple"
+SEARCH_VECTOR_SQL = """UPDATE {track_table} AS song_track SET search_vector =
+    setweight(to_tsvector('{config}', coalesce(song_track.name, '')), 'A') ||
+    setweight(to_tsvector('{config}', array_to_string(song_track.artists, ' ')), 'B') ||
+    setweight(to_tsvector('{config}', array_to_string(song_track.genres, ' ')), 'C') ||
+    setweight(to_tsvector('{config}', coalesce((SELECT string_agg(album.name, ' ') FROM {through_table} AS album_track
+        JOIN {album_table} AS album ON album.id = album_track.album_id WHERE album_track.songtrack_id = song_track.id), '')), 'D')"""
+CATALOG_CHANGES_KEY = "catalog:changes:{version}"
+CATALOG_ALBUM_STAMP_KEY = "catalog:album:{album_id}"
+CATALOG_MEMBERSHIP_KEY = "catalog:membership"
+CATALOG_WEIGHTS_KEY = "catalog:weights"
+CATALOG_WEIGHTS_CHANGES_KEY = "catalog:weights:{version}"
+CATALOG_MAX_REPLAYED_VERSIONS = 500
+TYPEAHEAD_TOP_K = 10
+TYPEAHEAD_MAX_PREFIX = 24
+TYPEAHEAD_BUCKET_DEPTH = 2
+TYPEAHEAD_DELTA_LIMIT = 1000
+SPELLING_MAX_DISTANCE = 2
+SPELLING_MIN_TERM_LENGTH = 3
+SPELLING_MIN_HITS = 3
+SPELLING_SUGGESTIONS = 5
+# share of retired terms, counted down to zero but still in the BK-tree, that triggers rebuilding the tree
+SPELLING_RETIRED_RATIO = 0.25
+SUGGEST_TOP_N = 20
+SUGGEST_POSTING_LIMIT = 500
+RECOMMEND_TOP_N = 20
+AUTO_PLAYLIST_SIZE = 10
+INVALID_TRACK_IDS_ERR = "One or more invalid song ids in songs list"
+PLAYLIST_NOT_FOUND_ERR = "No playlist exists correspnding to this id for the user"
+PLAYLIST_TRACKS_PREVIEW = 20
+PLAYLIST_TOP_GENRES = 5
+PLAYLIST_STATS_FIELDS = ["track_count", "total_duration_ms", "genre_counts", "top_genres"]
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from django.db import transaction
+from .clients import spotify_client, token_provider
+from .constants import *
+from .models import *
+from .persistence import CatalogWriter
+from .services import AlbumService
+from MusicProj.settings import SPOTIFY_MAX_WORKERS, CRAWL_CHUNK_SIZE, CRAWL_ARTIST_CACHE_SIZE
+
+
+class LRUCache(OrderedDict):
+    """A dict keeping only the maxsize most recently used entries"""
+
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+# streaming crawl of the whole new-releases catalog, persisted chunk by chunk with a resume checkpoint
+class CatalogCrawler:
+    def __init__(self, name="new-releases", chunk_size=CRAWL_CHUNK_SIZE, artist_cache_size=CRAWL_ARTIST_CACHE_SIZE):
+        self.checkpoint, _ = CrawlCheckpoint.objects.get_or_create(name=name)
+        self.chunk_size = chunk_size
+        self.artist_cache = LRUCache(artist_cache_size)
+
+    def iter_albums(self):
+        ''' parse stage: yield (page_url, index, album) from the checkpoint onwards, following the `next` cursors '''
+        start_url = self.checkpoint.page_url or 'browse/new-releases/'
+        skip = self.checkpoint.page_index if self.checkpoint.page_url else 0
+        querystring = {} if self.checkpoint.page_url else {"limit": NEW_RELEASES_PAGE_LIMIT, "offset": 0}
+
+        pages = spotify_client.paginate(start_url, token_provider.get_headers, querystring, items_key="albums")
+        for page_url, page in pages:
+            for index, data in enumerate(page.get("items") or []):
+                if index >= skip:
+                    yield page_url, index, AlbumService.parse_album(data)
+            skip = 0
+
+    def iter_chunks(self, albums):
+        chunk = []
+        for item in albums:
+            chunk.append(item)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def enrich(self, chunk):
+        ''' enrich stage: attach every track of the chunk's albums and collect their artists '''
+        headers = token_provider.get_headers()
+        albums = [album for page_url, index, album in chunk]
+        with ThreadPoolExecutor(max_workers=SPOTIFY_MAX_WORKERS) as executor:
+            album_tracks = list(executor.map(partial(AlbumService.fetch_album_tracks, headers=headers),
+                                                [album["id"] for album in albums]))
+
+        items = [track_data for tracks_response in album_tracks for track_data in tracks_response["items"]]
+        artist_ids = list(dict.fromkeys(artist["id"] for track_data in items for artist in track_data.get("artists") or []))
+        AlbumService.fetch_artists_from_api(artist_ids, headers, self.artist_cache)
+
+        for album, tracks_response in zip(albums, album_tracks):
+            album["tracks"] = [AlbumService.parse_track(track_data, self.artist_cache) for track_data in tracks_response["items"]]
+        artists = [AlbumService.parse_artist(self.artist_cache[artist_id]) for artist_id in artist_ids
+                        if artist_id in self.artist_cache]
+        return albums, artists
+
+    def persist(self, chunk, albums, artists):
+        ''' persist stage: write the chunk and move the checkpoint past it in the same transaction '''
+        page_url, index, album = chunk[-1]
+        with transaction.atomic():
+            CatalogWriter.save_page(albums, artists)
+            self.checkpoint.page_url = page_url
+            self.checkpoint.page_index = index + 1
+            self.checkpoint.albums_done += len(albums)
+            self.checkpoint.tracks_done += sum(len(album["tracks"]) for album in albums)
+            self.checkpoint.save()
+
+    def run(self, log=print):
+        if self.checkpoint.finished:
+            return self.checkpoint
+
+        for chunk in self.iter_chunks(self.iter_albums()):
+            albums, artists = self.enrich(chunk)
+            self.persist(chunk, albums, artists)
+            log("{} albums, {} tracks crawled".format(self.checkpoint.albums_done, self.checkpoint.tracks_done))
+
+        self.checkpoint.finished = True
+        self.checkpoint.save()
+        return self.checkpoint
+
+    def restart(self):
+        self.checkpoint.page_url, self.checkpoint.page_index = None, 0
+        self.checkpoint.albums_done = self.checkpoint.tracks_done = 0
+        self.checkpoint.finished = False
+        self.checkpoint.save()
@@ -4,8 +4,5 @@ class ThirdPartyError(Exception):
 class PlaylistException(Exception):
     pass
 
-class SongFetchError(Exception):
-    pass
-
 class APIException(Exception):
     pass
\ No newline at end of file
@@ -0,0 +1,187 @@
+import hashlib, json, random, threading, time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+
+class FakeCatalog:
+    """A synthetic Spotify catalog generated on the fly from integer indexes"""
+
+    GENRES = ["pop", "rock", "indie", "hip hop", "jazz", "classical", "electronic", "folk", "metal", "r&b",
+              "soul", "country", "reggae", "blues", "punk", "latin", "k-pop", "ambient", "house", "techno"]
+
+    def __init__(self, albums=200, tracks_per_album=12, artists=300, artists_per_track=2):
+        self.albums = albums
+        self.tracks_per_album = tracks_per_album
+        self.artists = artists
+        self.artists_per_track = artists_per_track
+
+    def artist_ref(self, index):
+        return {"id": "artist{:07d}".format(index), "name": "Artist {}".format(index)}
+
+    def artist(self, artist_id):
+        index = int(artist_id[len("artist"):])
+        genres = [self.GENRES[(index + offset) % len(self.GENRES)] for offset in range(1 + index % 3)]
+        return dict(self.artist_ref(index), popularity=index % 100, genres=genres,
+                    external_urls={"spotify": "https://open.spotify.com/artist/" + artist_id})
+
+    def album(self, index):
+        album_id = "album{:07d}".format(index)
+        return {"id": album_id, "album_type": "album", "name": "Album {}".format(index),
+                "release_date": "2020-{:02d}-01".format(1 + index % 12), "total_tracks": self.tracks_per_album,
+                "artists": [self.artist_ref(index % self.artists)], "available_markets": ["US"],
+                "external_urls": {"spotify": "https://open.spotify.com/album/" + album_id}}
+
+    def track(self, album_index, index):
+        track_id = "track{:07d}{:04d}".format(album_index, index)
+        artists = [self.artist_ref((album_index * 7 + index * 13 + offset) % self.artists)
+                    for offset in range(self.artists_per_track)]
+        return {"id": track_id, "name": "Track {} of album {}".format(index, album_index),
+                "duration_ms": 120000 + (album_index * 31 + index * 17) % 180000, "artists": artists,
+                "external_urls": {"spotify": "https://open.spotify.com/track/" + track_id}}
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    """Request handler serving the token, new-releases, album tracks and artists endpoints"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers={}):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_document(self, body):
+        ''' A 200 carrying an ETag of the body, or a 304 without payload when the client already holds it '''
+        etag = '"{}"'.format(hashlib.sha1(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest())
+        if self.headers.get("If-None-Match") == etag:
+            with self.server.lock:
+                self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_json(200, body, {"ETag": etag})
+
+    def paging(self, path, items_total, params, build):
+        limit = int(params.get("limit", ["20"])[0])
+        offset = int(params.get("offset", ["0"])[0])
+        end = min(offset + limit, items_total)
+        base = self.server.base_url + path
+        next_url = base + "?" + urlencode({"limit": limit, "offset": end}) if end < items_total else None
+        previous_url = base + "?" + urlencode({"limit": limit, "offset": max(offset - limit, 0)}) if offset else None
+        return {"items": [build(index) for index in range(offset, end)], "limit": limit, "offset": offset,
+                "total": items_total, "next": next_url, "previous": previous_url, "href": base}
+
+    def injected_failure(self, endpoint):
+        ''' Apply the configured latency, then maybe answer with an injected 429 or 500 '''
+        server = self.server
+        with server.lock:
+            server.calls[endpoint] += 1
+            scripted = server.scripted.popleft() if server.scripted else None
+        if server.latency:
+            time.sleep(server.latency)
+        if scripted == 429:
+            self.send_json(429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                            {"Retry-After": str(server.retry_after)})
+            return True
+        if scripted:
+            self.send_json(scripted, {"error": {"status": scripted, "message": "Server error"}})
+            return True
+        if server.throttle_rate and server.random.random() < server.throttle_rate:
+            self.send_json(429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                            {"Retry-After": str(server.retry_after)})
+            return True
+        if server.error_rate and server.random.random() < server.error_rate:
+            self.send_json(500, {"error": {"status": 500, "message": "Server error"}})
+            return True
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        if urlparse(self.path).path.rstrip("/") != "/api/token":
+            return self.send_json(404, {"error": "not found"})
+        if self.injected_failure("token"):
+            return
+        self.send_json(200, {"access_token": "fake-token", "token_type": "Bearer", "expires_in": 3600})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path.rstrip("/")
+        params = parse_qs(url.query)
+        catalog = self.server.catalog
+
+        if path == "/v1/browse/new-releases":
+            if self.injected_failure("new_releases"):
+                return
+            return self.send_document({"albums": self.paging("/v1/browse/new-releases", catalog.albums, params,
+                                                                 catalog.album)})
+
+        if path.startswith("/v1/albums/") and path.endswith("/tracks"):
+            album_id = path[len("/v1/albums/"):-len("/tracks")]
+            album_index = int(album_id[len("album"):])
+            if self.injected_failure("album_tracks"):
+                return
+            return self.send_document(self.paging(path, catalog.tracks_per_album, params,
+                                                  lambda index: catalog.track(album_index, index)))
+
+        if path == "/v1/artists":
+            if self.injected_failure("artists"):
+                return
+            ids = [artist_id for value in params.get("ids", []) for artist_id in value.split(",") if artist_id]
+            return self.send_document({"artists": [catalog.artist(artist_id) for artist_id in ids]})
+
+        self.send_json(404, {"error": "not found"})
+
+
+class FakeSpotifyServer(ThreadingHTTPServer):
+    """A local stand-in for the Spotify web api, used by benchmarks and tests"""
+
+    daemon_threads = True
+
+    def __init__(self, catalog, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, throttle_rate=0.0,
+                    retry_after=1, seed=0, script=()):
+        super().__init__((host, port), FakeSpotifyHandler)
+        self.catalog = catalog
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        # 304 answers to requests revalidating a body the client already holds
+        self.not_modified = 0
+        # statuses answered, in order, to the next requests before any regular response
+        self.scripted = deque(script)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    @property
+    def api_url(self):
+        return self.base_url + "/v1/"
+
+    @property
+    def auth_url(self):
+        return self.base_url + "/api/token"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,47 @@
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+from rest_framework import filters
+from .models import *
+from .constants import *
+
+
+class TrackFullTextSearchFilter(filters.SearchFilter):
+    """
+    Search filter matching the `search` terms against the indexed search vector of song tracks,
+    results are ranked with ts_rank. The last term matches as a prefix so partially typed words still hit
+    """
+    def build_query(self, search_terms):
+        ''' A raw tsquery and-ing the words of the terms, e.g. "beatles let it" -> 'beatles' & 'let' & 'it':* '''
+        words = ["'{}'".format(word) for term in search_terms for word in re.findall(r"\w+", term)]
+        if not words:
+            return None
+        words[-1] += ":*"
+        return SearchQuery(" & ".join(words), config=SEARCH_CONFIG, search_type="raw")
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+
+        query = self.build_query(search_terms)
+        if query is None:
+            return queryset.none()
+        return queryset.filter(search_vector=query) \
+                    .annotate(rank=SearchRank(F("search_vector"), query)).order_by("-rank", "id")
+
+
+class TrackRelationFilter(filters.BaseFilterBackend):
+    """
+    Filter song tracks by exact `genre` name and by Spotify `artist` id through the indexed relations
+    """
+    def filter_queryset(self, request, queryset, view):
+        genre = request.query_params.get("genre")
+        artist = request.query_params.get("artist")
+        if genre:
+            queryset = queryset.filter(id__in=SongTrack.track_genres.through.objects.filter(genre__name=genre)
+                                                .values("songtrack_id"))
+        if artist:
+            queryset = queryset.filter(id__in=SongTrack.track_artists.through.objects.filter(artist_id=artist)
+                                                .values("songtrack_id"))
+        return queryset
@@ -0,0 +1,127 @@
+import hashlib, json, os, tempfile, threading, time, traceback
+
+
+# on-disk store of Spotify response bodies with their validators, sharded by key prefix
+class ResponseCache:
+    def __init__(self, directory, default_ttl=0, ttls=None, max_bytes=None, prune_every=1000):
+        self.directory = directory
+        self.default_ttl = default_ttl
+        # ttl per path prefix, the longest matching prefix wins
+        self.ttls = sorted((ttls or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.max_bytes = max_bytes
+        # stores between two prunes of the directory, every client thread stores so the counter is locked
+        self.prune_every = prune_every
+        self.stores = 0
+        self.lock = threading.Lock()
+        # the thread pruning the directory, if one is running
+        self.pruner = None
+
+    def key(self, request_url, querystring={}):
+        params = json.dumps(sorted((str(name), str(value)) for name, value in (querystring or {}).items()))
+        return hashlib.sha256((request_url + "?" + params).encode("utf-8")).hexdigest()
+
+    def ttl_for(self, path):
+        for prefix, ttl in self.ttls:
+            if path.startswith(prefix):
+                return ttl
+        return self.default_ttl
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def load(self, key):
+        try:
+            with open(self.path_for(key), encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, key, entry):
+        ''' Write the entry atomically so concurrent readers never see a partial file '''
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as cache_file:
+                json.dump(entry, cache_file)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with self.lock:
+            self.stores += 1
+            pruner = None
+            # walking the directory takes long, the store that makes a prune due only starts it in the background
+            if self.prune_every and self.stores % self.prune_every == 0 and self.pruner is None:
+                pruner = self.pruner = threading.Thread(target=self.prune_in_background, daemon=True)
+        if pruner is not None:
+            pruner.start()
+
+    def prune_in_background(self):
+        try:
+            self.prune()
+        except Exception:
+            # a failed prune is retried with the next one that is due
+            traceback.print_exc()
+        finally:
+            with self.lock:
+                self.pruner = None
+
+    def prune(self, now=None):
+        ''' Delete the entries older than the longest ttl, which can't be fresh anymore, then the least recently
+            stored ones until the directory fits in max_bytes. Returns the number of files removed
+        '''
+        now = now or time.time()
+        max_age = max([self.default_ttl] + [ttl for _, ttl in self.ttls])
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        removed, kept, total = 0, [], 0
+        for modified_at, size, path in files:
+            # entries are rewritten on every store and revalidation, so the mtime is their stored_at
+            if now - modified_at > max_age:
+                removed += self.remove(path)
+            else:
+                kept.append((modified_at, size, path))
+                total += size
+
+        if self.max_bytes is not None:
+            for modified_at, size, path in sorted(kept):
+                if total <= self.max_bytes:
+                    break
+                removed += self.remove(path)
+                total -= size
+        return removed
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+    def is_fresh(self, entry):
+        return time.time() - entry.get("stored_at", 0) < entry.get("ttl", 0)
+
+    def touch(self, key, entry, ttl):
+        entry.update(stored_at=time.time(), ttl=ttl)
+        self.store(key, entry)
+
+    def get_document(self, kind, document_id):
+        ''' Return a single cached document (e.g. an artist) while it is within its ttl '''
+        entry = self.load(self.key(kind + "/" + document_id))
+        if entry and self.is_fresh(entry):
+            return entry.get("body")
+        return None
+
+    def set_document(self, kind, document_id, document):
+        self.store(self.key(kind + "/" + document_id), {"body": document, "stored_at": time.time(),
+                                                        "ttl": self.ttl_for(kind + "/")})
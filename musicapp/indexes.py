@@ -0,0 +1,576 @@
+import abc, bisect, heapq, re, threading, time, traceback, unicodedata
+from array import array
+from collections import Counter
+from django.db import connection
+from django.db.models import Count
+from fuzzywuzzy import fuzz
+from .cache import CatalogCache
+from .constants import *
+from .models import *
+from MusicProj.settings import CATALOG_INDEX_REFRESH_INTERVAL
+
+
+def normalize(text):
+    ''' Lowercase, strip accents and collapse whitespace so lookups ignore case and diacritics '''
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class CatalogIndex(abc.ABC):
+    """
+    Base class of the per-worker in-memory indexes over the catalog. A background thread keeps each index
+    in step with the catalog version ingestion bumps, replaying the changed ids when they are still known and
+    rebuilding from the database otherwise. Playlist edits publish their reweighted tracks on a channel of
+    their own, so they never push the catalog changes out of the replay window. Requests only read the
+    index, they never build or refresh it
+    """
+    instance = None
+    instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.version = None
+        self.weights_version = None
+        self.refresher = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls.__dict__.get("instance") is None:
+            with cls.instance_lock:
+                if cls.__dict__.get("instance") is None:
+                    cls.instance = cls()
+        return cls.instance
+
+    @classmethod
+    def get(cls):
+        ''' The index as last refreshed, None until its first build in the background is done '''
+        instance = cls.get_instance()
+        if instance.refresher is None:
+            instance.start()
+        return instance if instance.version is not None else None
+
+    def start(self):
+        with self.instance_lock:
+            if self.refresher is None:
+                self.refresher = threading.Thread(target=self.refresh_forever, daemon=True)
+                self.refresher.start()
+
+    def refresh_forever(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                # the previous state keeps being served, the next round retries
+                traceback.print_exc()
+            finally:
+                connection.close()
+            time.sleep(CATALOG_INDEX_REFRESH_INTERVAL)
+
+    def refresh(self):
+        # both versions are read before loading anything, a write landing meanwhile is caught next time
+        weights = CatalogCache.get_version(CATALOG_WEIGHTS_KEY)
+        current = CatalogCache.get_version()
+        if current != self.version:
+            changes = CatalogCache.get_changes(self.version, current) if self.version is not None else None
+            if changes is None:
+                self.rebuild()
+                self.weights_version = weights
+            else:
+                self.apply(changes)
+            self.version = current
+
+        if weights != self.weights_version:
+            changes = CatalogCache.get_changes(self.weights_version, weights, CATALOG_WEIGHTS_CHANGES_KEY)
+            # too many playlist edits to replay, every weight is reloaded
+            self.reweigh(None if changes is None else changes.get("tracks", set()))
+            self.weights_version = weights
+
+    @abc.abstractmethod
+    def rebuild(self):
+        ''' Load the whole index from the database '''
+
+    def apply(self, changes):
+        self.rebuild()
+
+    def reweigh(self, track_ids):
+        ''' Follow the playlist membership of the tracks (of every track when None), for indexes ranking by it '''
+
+
+class PrefixSnapshot:
+    """
+    One immutable state of the typeahead. Each name and its word-start suffixes, normalized and cut to
+    TYPEAHEAD_MAX_PREFIX characters, are kept in one sorted array of keys next to an array of entry numbers,
+    so the keys starting with a prefix are a bisected range. Prefixes of up to TYPEAHEAD_BUCKET_DEPTH
+    characters have the largest ranges and keep their top entries precomputed. Changed entries go to a small
+    sorted delta, a change derives a new snapshot and the arrays are only rebuilt once the delta grows
+    """
+    KINDS = ("track", "album", "artist")
+
+    def __init__(self):
+        # entries by number, only ever appended to, an entry is retired when a newer number takes over its (kind, id)
+        self.kinds = array("B")
+        self.ids = []
+        self.names = []
+        self.weights = array("I")
+        self.live = {}
+        self.keys = []
+        self.postings = array("I")
+        self.delta = []
+        self.buckets = {}
+
+    @classmethod
+    def keys_for(cls, name):
+        ''' The normalized name and every word-start suffix of it, cut to TYPEAHEAD_MAX_PREFIX characters '''
+        normalized = normalize(name)
+        starts = [0] + [index + 1 for index, char in enumerate(normalized) if char == " "]
+        return {normalized[start:start + TYPEAHEAD_MAX_PREFIX] for start in starts if normalized[start:]}
+
+    @classmethod
+    def bucket_prefixes(cls, keys):
+        return {key[:depth] for key in keys for depth in range(1, min(len(key), TYPEAHEAD_BUCKET_DEPTH) + 1)}
+
+    def add_entry(self, kind, entry_id, name, weight):
+        number = len(self.ids)
+        self.kinds.append(self.KINDS.index(kind))
+        self.ids.append(entry_id)
+        self.names.append(name)
+        self.weights.append(max(int(weight or 0), 0))
+        self.live[(kind, entry_id)] = number
+        return number
+
+    def is_live(self, number):
+        return self.live.get((self.KINDS[self.kinds[number]], self.ids[number])) == number
+
+    def top(self, numbers, limit=TYPEAHEAD_TOP_K):
+        return heapq.nlargest(limit, numbers, key=lambda number: (self.weights[number], -number))
+
+    def range_numbers(self, prefix):
+        ''' The live entry numbers having a key that starts with prefix '''
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        numbers = set(self.postings[bisect.bisect_left(self.keys, prefix):bisect.bisect_left(self.keys, upper)])
+        numbers.update(number for _, number in self.delta[bisect.bisect_left(self.delta, (prefix,)):
+                                                           bisect.bisect_left(self.delta, (upper,))])
+        return [number for number in numbers if self.is_live(number)]
+
+    @classmethod
+    def build(cls, entries):
+        ''' A snapshot of (kind, id, name, weight) entries '''
+        snapshot, pairs = cls(), []
+        for kind, entry_id, name, weight in entries:
+            if name:
+                number = snapshot.add_entry(kind, entry_id, name, weight)
+                pairs.extend((key, number) for key in cls.keys_for(name))
+        pairs.sort()
+        snapshot.keys = [key for key, _ in pairs]
+        snapshot.postings = array("I", (number for _, number in pairs))
+        snapshot.buckets = {prefix: snapshot.top(snapshot.range_numbers(prefix))
+                                for prefix in cls.bucket_prefixes(snapshot.keys)}
+        return snapshot
+
+    def compact(self):
+        ''' A snapshot with the delta merged into the sorted arrays and the retired entries dropped '''
+        return self.build((self.KINDS[self.kinds[number]], self.ids[number], self.names[number], self.weights[number])
+                            for number in sorted(self.live.values()))
+
+    def derive(self, entries):
+        ''' A snapshot with the (kind, id, name, weight) entries added or replaced, the keys of their previous names
+            and weights stop matching. Readers of this snapshot are unaffected: the entry arrays are only appended
+            to and everything else that changes is copied
+        '''
+        snapshot = PrefixSnapshot()
+        snapshot.kinds, snapshot.ids, snapshot.names, snapshot.weights = self.kinds, self.ids, self.names, self.weights
+        snapshot.keys, snapshot.postings = self.keys, self.postings
+        snapshot.live, snapshot.delta, snapshot.buckets = dict(self.live), list(self.delta), dict(self.buckets)
+        for kind, entry_id, name, weight in entries:
+            snapshot.put(kind, entry_id, name, weight)
+        if len(snapshot.delta) > max(TYPEAHEAD_DELTA_LIMIT, len(snapshot.keys) // 10):
+            return snapshot.compact()
+        return snapshot
+
+    def update_bucket(self, prefix, added, retired):
+        bucket = self.buckets.get(prefix)
+        if bucket is None:
+            # the first entry under the prefix, every prefix with entries has its bucket
+            if added is not None:
+                self.buckets[prefix] = self.top(self.range_numbers(prefix))
+            return
+        # a retired entry of the bucket may leave room for one outside of it, the bucket is recomputed
+        if retired in bucket and (added is None or self.weights[added] < self.weights[retired]):
+            self.buckets[prefix] = self.top(self.range_numbers(prefix))
+            return
+        self.buckets[prefix] = self.top([number for number in bucket if number != retired] +
+                                        ([added] if added is not None else []))
+
+    def put(self, kind, entry_id, name, weight):
+        retired = self.live.pop((kind, entry_id), None)
+        retired_prefixes = self.bucket_prefixes(self.keys_for(self.names[retired])) if retired is not None else set()
+        added, added_prefixes = None, set()
+        if name:
+            added = self.add_entry(kind, entry_id, name, weight)
+            keys = self.keys_for(name)
+            for key in keys:
+                bisect.insort(self.delta, (key, added))
+            added_prefixes = self.bucket_prefixes(keys)
+
+        for prefix in retired_prefixes | added_prefixes:
+            self.update_bucket(prefix, added if prefix in added_prefixes else None,
+                               retired if prefix in retired_prefixes else None)
+
+    def lookup(self, prefix, limit=TYPEAHEAD_TOP_K):
+        prefix = normalize(prefix)[:TYPEAHEAD_MAX_PREFIX]
+        if not prefix:
+            return []
+        if len(prefix) <= TYPEAHEAD_BUCKET_DEPTH:
+            numbers = self.buckets.get(prefix, [])
+        else:
+            numbers = self.top(self.range_numbers(prefix), limit)
+        return [{"type": self.KINDS[self.kinds[number]], "id": self.ids[number], "name": self.names[number]}
+                    for number in numbers[:limit]]
+
+
+class PrefixIndex(CatalogIndex):
+    """
+    Typeahead over track, artist and album names, ranked by playlist membership for tracks and albums and
+    by Spotify popularity for artists. Lookups read the current PrefixSnapshot, the refresher swaps in a
+    new one with a single assignment
+    """
+    def __init__(self):
+        super().__init__()
+        self.snapshot = PrefixSnapshot()
+
+    def load_entries(self, track_ids=None, album_ids=None, artist_ids=None):
+        ''' Yield (kind, id, name, weight) for the given ids, every entry is loaded without ids '''
+        tracks = SongTrack.objects.all() if track_ids is None else SongTrack.objects.filter(id__in=track_ids)
+        albums = Album.objects.all() if album_ids is None else Album.objects.filter(id__in=album_ids)
+        artists = Artist.objects.all() if artist_ids is None else Artist.objects.filter(id__in=artist_ids)
+
+        for entry_id, name, weight in tracks.annotate(weight=Count("playlist")).values_list("id", "name", "weight").iterator():
+            yield "track", entry_id, name, weight
+        for entry_id, name, weight in albums.annotate(weight=Count("tracks__playlist")).values_list("id", "name", "weight").iterator():
+            yield "album", entry_id, name, weight
+        for entry_id, name, popularity in artists.values_list("id", "name", "popularity").iterator():
+            yield "artist", entry_id, name, int(popularity) if str(popularity or "").isdigit() else 0
+
+    def rebuild(self):
+        self.snapshot = PrefixSnapshot.build(self.load_entries())
+
+    def apply(self, changes):
+        self.snapshot = self.snapshot.derive(self.load_entries(list(changes.get("tracks", [])), list(changes.get("albums", [])),
+                                                               list(changes.get("artists", []))))
+
+    def reweigh(self, track_ids):
+        if track_ids is None:
+            self.rebuild()
+            return
+        # the albums of the tracks are reweighted with them
+        album_ids = Album.tracks.through.objects.filter(songtrack_id__in=list(track_ids)).values_list("album_id", flat=True)
+        self.snapshot = self.snapshot.derive(self.load_entries(list(track_ids), list(album_ids), []))
+
+    def lookup(self, prefix, limit=TYPEAHEAD_TOP_K):
+        return self.snapshot.lookup(prefix, limit)
+
+
+def levenshtein(source, target, max_distance=None):
+    ''' Edit distance between two strings, any value above max_distance is reported as max_distance + 1 '''
+    if max_distance is None:
+        max_distance = max(len(source), len(target))
+    if abs(len(source) - len(target)) > max_distance:
+        return max_distance + 1
+
+    previous = list(range(len(target) + 1))
+    for row, source_char in enumerate(source, 1):
+        current = [row]
+        for column, target_char in enumerate(target, 1):
+            current.append(min(previous[column] + 1, current[column - 1] + 1,
+                                previous[column - 1] + (source_char != target_char)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over a vocabulary. Children are keyed by their exact distance to the parent term,
+    and the triangle inequality of the edit distance lets a search skip every subtree whose edge distance
+    is outside [d - max_distance, d + max_distance]
+    """
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        self.root = None
+
+    def add(self, term):
+        if self.root is None:
+            self.root = (term, {})
+            return
+
+        node = self.root
+        while True:
+            distance = levenshtein(term, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (term, {})
+                return
+            node = child
+
+    def walk(self, term, max_distance):
+        ''' The (distance, term) pairs within max_distance of term and the number of nodes visited '''
+        matches, visited, stack = [], 0, [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            visited += 1
+            # past max_distance + the largest edge no child can be in range, the exact distance isn't needed
+            bound = max_distance + max(node[1], default=0)
+            distance = levenshtein(term, node[0], bound)
+            if distance <= max_distance:
+                matches.append((distance, node[0]))
+            if distance > bound:
+                continue
+            # a copy, the refresher may add a child meanwhile
+            for edge, child in list(node[1].items()):
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return matches, visited
+
+    def search(self, term, max_distance):
+        return self.walk(term, max_distance)[0]
+
+
+class SpellingIndex(CatalogIndex):
+    """
+    Vocabulary of track words, artist names and genres for "did you mean" suggestions, held in a BK-tree.
+    The terms each track and artist contributed are kept, so a changed one takes its old terms back before
+    adding its new ones. The tree can't drop a node, terms counted down to zero are left in it as retired
+    and skipped by searches until enough of them pile up to rebuild the tree from the live vocabulary
+    """
+    def __init__(self):
+        super().__init__()
+        self.tree = BKTree(SPELLING_MAX_DISTANCE)
+        self.frequency = Counter()
+        self.contributions = {}
+        self.retired = set()
+
+    def terms_for(self, track_names=(), artist_names=(), genres=()):
+        for name in track_names:
+            for word in normalize(name).split(" "):
+                if len(word) >= SPELLING_MIN_TERM_LENGTH:
+                    yield word
+        for name in list(artist_names) + list(genres):
+            term = normalize(name)
+            if len(term) >= SPELLING_MIN_TERM_LENGTH:
+                yield term
+                for word in term.split(" "):
+                    if len(word) >= SPELLING_MIN_TERM_LENGTH:
+                        yield word
+
+    def load_terms(self, track_ids=None, artist_ids=None):
+        ''' (source, terms) pairs of the tracks and artists, a source being ("track", id) or ("artist", id) '''
+        tracks = SongTrack.objects.all() if track_ids is None else SongTrack.objects.filter(id__in=track_ids)
+        artists = Artist.objects.all() if artist_ids is None else Artist.objects.filter(id__in=artist_ids)
+        for track_id, name, track_artists, track_genres in tracks.values_list("id", "name", "artists", "genres").iterator():
+            genres = [genre for value in track_genres or [] for genre in value.split(",")]
+            yield ("track", track_id), tuple(self.terms_for([name or ""], track_artists or [], genres))
+        for artist_id, name in artists.values_list("id", "name").iterator():
+            yield ("artist", artist_id), tuple(self.terms_for(artist_names=[name or ""]))
+
+    def rebuild(self):
+        frequency, contributions = Counter(), {}
+        for source, terms in self.load_terms():
+            contributions[source] = terms
+            frequency.update(terms)
+        self.tree, self.frequency, self.contributions, self.retired = (self.build_tree(frequency), frequency,
+                                                                      contributions, set())
+
+    def build_tree(self, terms):
+        tree = BKTree(SPELLING_MAX_DISTANCE)
+        for term in terms:
+            tree.add(term)
+        return tree
+
+    def apply(self, changes):
+        track_ids, artist_ids = list(changes.get("tracks", [])), list(changes.get("artists", []))
+        # deleted tracks and artists aren't loaded, they contribute nothing any more
+        loaded = dict(self.load_terms(track_ids, artist_ids))
+        sources = [("track", track_id) for track_id in track_ids] + [("artist", artist_id) for artist_id in artist_ids]
+
+        dropped = set()
+        for source in sources:
+            old = self.contributions.pop(source, ())
+            self.frequency.subtract(old)
+            dropped.update(old)
+        for source in sources:
+            terms = loaded.get(source)
+            if not terms:
+                continue
+            self.contributions[source] = terms
+            for term in terms:
+                # adding a term already in the tree, retired or not, leaves it as it is
+                if self.frequency[term] <= 0:
+                    self.tree.add(term)
+                self.retired.discard(term)
+            self.frequency.update(terms)
+
+        for term in dropped:
+            if self.frequency[term] <= 0:
+                del self.frequency[term]
+                self.retired.add(term)
+        if len(self.retired) > len(self.frequency) * SPELLING_RETIRED_RATIO:
+            self.tree, self.retired = self.build_tree(list(self.frequency)), set()
+
+    def correct(self, word):
+        ''' Closest vocabulary terms of a word, nearest first, then the most frequent and most similar '''
+        max_distance = 1 if len(word) <= 4 else SPELLING_MAX_DISTANCE
+        matches = [match for match in self.tree.search(word, max_distance) if self.frequency[match[1]] > 0]
+        matches.sort(key=lambda match: (match[0], -self.frequency[match[1]], -fuzz.ratio(word, match[1])))
+        return [term for distance, term in matches]
+
+    def suggest(self, query, limit=SPELLING_SUGGESTIONS):
+        ''' "Did you mean" rewrites of a query, built from the whole query and from word by word corrections '''
+        query = normalize(query)
+        if not query:
+            return []
+
+        suggestions = [term for term in self.correct(query) if term != query]
+        corrected = [(self.correct(word) or [word])[0] if word not in self.frequency else word for word in query.split(" ")]
+        rewrite = " ".join(corrected)
+        if rewrite != query:
+            suggestions.insert(0, rewrite)
+        return list(dict.fromkeys(suggestions))[:limit]
+
+
+
+class SuggestionIndex(CatalogIndex):
+    """
+    Inverted index from genres, artists and albums to the tracks carrying them. Every posting list is ordered
+    most popular first (playlist membership, then position), so scoring only reads the first
+    SUGGEST_POSTING_LIMIT entries of each list. Posting lists are replaced rather than changed in place
+    """
+    FACETS = ("genre", "artist", "album")
+
+    def __init__(self):
+        super().__init__()
+        self.track_ids = []
+        self.positions = {}
+        self.weights = array("I")
+        self.track_features = {}
+        self.postings = {facet: {} for facet in self.FACETS}
+
+    def rank(self, position):
+        return -self.weights[position], position
+
+    def load_links(self, track_ids=None):
+        genre_links = SongTrack.track_genres.through.objects.values_list("songtrack_id", "genre_id")
+        artist_links = SongTrack.track_artists.through.objects.values_list("songtrack_id", "artist_id")
+        album_links = Album.tracks.through.objects.values_list("songtrack_id", "album_id")
+        for facet, links in zip(self.FACETS, (genre_links, artist_links, album_links)):
+            if track_ids is not None:
+                links = links.filter(songtrack_id__in=track_ids)
+            for track_id, feature_id in links.iterator():
+                yield track_id, facet, feature_id
+
+    def add_link(self, position, facet, feature_id):
+        features = self.track_features.setdefault(position, set())
+        if (facet, feature_id) not in features:
+            features.add((facet, feature_id))
+            self.postings[facet].setdefault(feature_id, array("I")).append(position)
+
+    def insert(self, positions, position):
+        ''' A copy of the posting list with position inserted in rank order '''
+        low, high, rank = 0, len(positions), self.rank(position)
+        while low < high:
+            middle = (low + high) // 2
+            if self.rank(positions[middle]) < rank:
+                low = middle + 1
+            else:
+                high = middle
+        return positions[:low] + array("I", [position]) + positions[low:]
+
+    def rebuild(self):
+        # built aside and swapped in, requests keep reading the previous postings meanwhile
+        index = SuggestionIndex()
+        ranked = SongTrack.objects.annotate(weight=Count("playlist")).order_by("-weight", "id").values_list("id", "weight")
+        for track_id, weight in ranked.iterator():
+            index.positions[track_id] = len(index.track_ids)
+            index.track_ids.append(track_id)
+            index.weights.append(weight)
+
+        for track_id, facet, feature_id in self.load_links():
+            if track_id in index.positions:
+                index.add_link(index.positions[track_id], facet, feature_id)
+        for facet_postings in index.postings.values():
+            for feature_id, positions in facet_postings.items():
+                facet_postings[feature_id] = array("I", sorted(positions))
+
+        self.track_ids, self.positions, self.weights = index.track_ids, index.positions, index.weights
+        self.track_features, self.postings = index.track_features, index.postings
+
+    def apply(self, changes):
+        ''' Replace the links of every changed track, its stale genres, artists and albums drop out '''
+        # new tracks are in no playlist yet, they rank after every other track
+        track_ids = list(changes.get("tracks", []))
+        for track_id in track_ids:
+            if track_id not in self.positions:
+                self.positions[track_id] = len(self.track_ids)
+                self.track_ids.append(track_id)
+                self.weights.append(0)
+
+        links = {self.positions[track_id]: set() for track_id in track_ids}
+        for track_id, facet, feature_id in self.load_links(track_ids):
+            links[self.positions[track_id]].add((facet, feature_id))
+
+        for position, features in links.items():
+            current = self.track_features.get(position, set())
+            for facet, feature_id in current - features:
+                positions = array("I", (other for other in self.postings[facet][feature_id] if other != position))
+                if positions:
+                    self.postings[facet][feature_id] = positions
+                else:
+                    del self.postings[facet][feature_id]
+            for facet, feature_id in features - current:
+                self.postings[facet][feature_id] = self.insert(self.postings[facet].get(feature_id, array("I")), position)
+            if features:
+                self.track_features[position] = features
+            else:
+                self.track_features.pop(position, None)
+
+    def reweigh(self, track_ids):
+        if track_ids is None:
+            self.rebuild()
+            return
+        weights = SongTrack.objects.filter(id__in=list(track_ids)).annotate(weight=Count("playlist")).values_list("id", "weight")
+        moved = set()
+        for track_id, weight in weights:
+            position = self.positions.get(track_id)
+            if position is not None and self.weights[position] != weight:
+                self.weights[position] = weight
+                moved.update(self.track_features.get(position, ()))
+        # the posting lists holding a reweighted track are sorted again
+        for facet, feature_id in moved:
+            self.postings[facet][feature_id] = array("I", sorted(self.postings[facet][feature_id], key=self.rank))
+
+    def suggest(self, owned_track_ids, limit=SUGGEST_TOP_N):
+        ''' Top `limit` track ids per facet, scored by how many of the owned tracks share each feature '''
+        owned = {self.positions[track_id] for track_id in owned_track_ids if track_id in self.positions}
+        profile = Counter(feature for position in owned for feature in self.track_features.get(position, ()))
+
+        suggestions = {}
+        for facet in self.FACETS:
+            scores = Counter()
+            for (feature_facet, feature_id), weight in profile.items():
+                if feature_facet != facet:
+                    continue
+                for position in self.postings[facet].get(feature_id, ())[:SUGGEST_POSTING_LIMIT]:
+                    if position not in owned:
+                        scores[position] += weight
+            # ties go to the more popular track
+            best = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1],) + self.rank(item[0]))
+            suggestions[facet] = [(self.track_ids[position], score) for position, score in best]
+        return suggestions
+
+
+def warm_indexes():
+    ''' Start building the per-worker indexes when the worker starts rather than on their first request '''
+    for index in (PrefixIndex, SpellingIndex, SuggestionIndex):
+        index.get_instance().start()
@@ -0,0 +1,220 @@
+import hashlib, json, threading, time, traceback
+from datetime import timedelta
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from base.utils import chunked
+from .clients import token_provider
+from .constants import *
+from .models import *
+from .persistence import CatalogWriter
+from .services import AlbumService
+from MusicProj.settings import INGESTION_JOB_TIMEOUT, INGESTION_RETRY_DELAY, INGESTION_HEARTBEAT_INTERVAL
+
+
+# db backed queue of ingestion jobs, shared by every worker process
+class IngestionQueue:
+    @classmethod
+    def unique_key(cls, job_type, payload):
+        return hashlib.sha256(json.dumps([job_type, payload], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+    @classmethod
+    def enqueue(cls, job_type, payload, unique=False):
+        ''' Queue a job, with unique=True an identical job that is still waiting or running is reused.
+            The partial unique index on unique_key settles concurrent enqueues, the loser reads the winner's job
+        '''
+        if not unique:
+            return IngestionJob.objects.create(job_type=job_type, payload=payload)
+
+        unique_key = cls.unique_key(job_type, payload)
+        while True:
+            try:
+                with transaction.atomic():
+                    return IngestionJob.objects.create(job_type=job_type, payload=payload, unique_key=unique_key)
+            except IntegrityError:
+                job = IngestionJob.objects.filter(unique_key=unique_key,
+                                    status__in=[IngestionJob.PENDING, IngestionJob.RUNNING]).first()
+                # None when the conflicting job finished in between, the insert can be tried again
+                if job:
+                    return job
+
+
+    @classmethod
+    def claim(cls, worker_id):
+        ''' Lock the next runnable job for this worker, jobs locked by other workers are skipped.
+            Running jobs whose worker stopped responding for INGESTION_JOB_TIMEOUT are claimed again
+        '''
+        now = timezone.now()
+        stale = now - timedelta(seconds=INGESTION_JOB_TIMEOUT)
+        with transaction.atomic():
+            job = IngestionJob.objects.select_for_update(skip_locked=True).filter(
+                        Q(status=IngestionJob.PENDING, run_after__lte=now) |
+                        Q(status=IngestionJob.RUNNING, locked_at__lt=stale)
+                    ).order_by("run_after").first()
+            if job is None:
+                return None
+
+            job.status = IngestionJob.RUNNING
+            job.locked_by = worker_id
+            job.locked_at = job.started_at = now
+            job.attempts += 1
+            job.save(update_fields=["status", "locked_by", "locked_at", "started_at", "attempts", "updated_at"])
+            return job
+
+
+    @classmethod
+    def heartbeat(cls, job, worker_id):
+        ''' Renew the lease of a running job, False once another worker has taken it over '''
+        return IngestionJob.objects.filter(uid=job.uid, status=IngestionJob.RUNNING, locked_by=worker_id) \
+                    .update(locked_at=timezone.now()) == 1
+
+
+    @classmethod
+    def lease(cls, job):
+        ''' The job while this worker still holds its lease, a reclaimed job belongs to its new worker '''
+        return IngestionJob.objects.filter(uid=job.uid, status=IngestionJob.RUNNING, locked_by=job.locked_by)
+
+
+    @classmethod
+    def complete(cls, job):
+        ''' Mark the job done, False when its lease was lost and the job is left to its new worker '''
+        job.status = IngestionJob.DONE
+        job.finished_at = timezone.now()
+        job.duration_ms = int((job.finished_at - job.started_at).total_seconds() * 1000)
+        job.last_error = None
+        return cls.lease(job).update(status=job.status, finished_at=job.finished_at, duration_ms=job.duration_ms,
+                                     last_error=None, updated_at=job.finished_at) == 1
+
+
+    @classmethod
+    def fail(cls, job, error):
+        ''' Reschedule the job with an exponential delay, or mark it failed once out of attempts.
+            False when its lease was lost and the job is left to its new worker
+        '''
+        job.finished_at = timezone.now()
+        job.duration_ms = int((job.finished_at - job.started_at).total_seconds() * 1000)
+        job.last_error = error
+        if job.attempts < job.max_attempts:
+            job.status = IngestionJob.PENDING
+            job.run_after = job.finished_at + timedelta(seconds=INGESTION_RETRY_DELAY * (2 ** (job.attempts - 1)))
+        else:
+            job.status = IngestionJob.FAILED
+        # only the fields of the outcome, a full save would write back a stale lease
+        failed = cls.lease(job).update(status=job.status, run_after=job.run_after, finished_at=job.finished_at,
+                                       duration_ms=job.duration_ms, last_error=error, locked_by=None, locked_at=None,
+                                       updated_at=job.finished_at) == 1
+        job.locked_by = job.locked_at = None
+        return failed
+
+
+# background thread renewing the lease of a running job, so long jobs aren't reclaimed as abandoned
+class JobHeartbeat:
+    def __init__(self, job, worker_id, interval=INGESTION_HEARTBEAT_INTERVAL):
+        self.job = job
+        self.worker_id = worker_id
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat, daemon=True)
+
+    def beat(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                if not IngestionQueue.heartbeat(self.job, self.worker_id):
+                    break
+        finally:
+            # the thread has its own db connection
+            connection.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+# handlers running the claimed jobs, each one a slice of the ingestion pipeline
+class IngestionJobRunner:
+    @classmethod
+    def run(cls, job):
+        handler = {
+            IngestionJob.NEW_RELEASES: cls.new_releases,
+            IngestionJob.ALBUM_TRACKS: cls.album_tracks,
+            IngestionJob.ARTIST_BATCH: cls.artist_batch,
+        }[job.job_type]
+        handler(job.payload)
+
+
+    @classmethod
+    def new_releases(cls, payload):
+        ''' Store the albums of a new-releases page and queue one album_tracks job per album '''
+        page = AlbumService.fetch_new_releases(payload.get("limit", 20), payload.get("offset", 0))
+        albums = [AlbumService.parse_album(data) for data in page.get("albums").get("items")]
+
+        with transaction.atomic():
+            CatalogWriter.save_albums(albums)
+            for album in albums:
+                IngestionQueue.enqueue(IngestionJob.ALBUM_TRACKS, {"album_id": album["id"]}, unique=True)
+
+
+    @classmethod
+    def album_tracks(cls, payload):
+        ''' Store the tracks of an album together with their artists '''
+        headers = token_provider.get_headers()
+        tracks_response = AlbumService.fetch_album_tracks(payload["album_id"], headers)
+        items = tracks_response.get("items") or []
+
+        artist_ids = [artist["id"] for track_data in items for artist in track_data.get("artists") or []]
+        artist_cache = AlbumService.fetch_artists_from_api(artist_ids, headers, {})
+        tracks = [AlbumService.parse_track(track_data, artist_cache) for track_data in items]
+
+        with transaction.atomic():
+            CatalogWriter.save_artists([AlbumService.parse_artist(details) for details in artist_cache.values()])
+            CatalogWriter.save_tracks({payload["album_id"]: tracks})
+
+
+    @classmethod
+    def artist_batch(cls, payload):
+        ''' Refresh a batch of up to ARTIST_BATCH_SIZE stored artists '''
+        headers = token_provider.get_headers()
+        artist_data = AlbumService.fetch_artist_batch(payload["ids"], headers)
+        CatalogWriter.save_artists([AlbumService.parse_artist(details) for details in artist_data if details])
+
+
+    @classmethod
+    def enqueue_artist_refresh(cls):
+        artist_ids = list(Artist.objects.order_by("id").values_list("id", flat=True))
+        return [IngestionQueue.enqueue(IngestionJob.ARTIST_BATCH, {"ids": batch})
+                    for batch in chunked(artist_ids, ARTIST_BATCH_SIZE)]
+
+
+    @classmethod
+    def work(cls, worker_id, poll_interval=5, max_jobs=None, once=False, log=print):
+        ''' Claim and run jobs until the queue is drained (once=True) or max_jobs have run '''
+        processed = 0
+        while max_jobs is None or processed < max_jobs:
+            job = IngestionQueue.claim(worker_id)
+            if job is None:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            try:
+                with JobHeartbeat(job, worker_id):
+                    cls.run(job)
+            except Exception:
+                if IngestionQueue.fail(job, traceback.format_exc()):
+                    log("{} {} failed on attempt {}".format(job.job_type, job.payload, job.attempts))
+                else:
+                    log("{} {} failed after its lease was lost".format(job.job_type, job.payload))
+            else:
+                if IngestionQueue.complete(job):
+                    log("{} {} done in {} ms".format(job.job_type, job.payload, job.duration_ms))
+                else:
+                    log("{} {} finished after its lease was lost".format(job.job_type, job.payload))
+            processed += 1
+
+        return processed
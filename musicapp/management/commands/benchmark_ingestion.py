@@ -0,0 +1,82 @@
+import time, tracemalloc
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from musicapp.clients import spotify_client, token_provider
+from musicapp.crawler import CatalogCrawler
+from musicapp.fake_spotify import FakeCatalog, FakeSpotifyServer
+from musicapp.services import AlbumService
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Benchmark Spotify ingestion against the local fake Spotify server"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=["pages", "crawl"], default="pages",
+                            help="pages runs the fetch-tracks ingestion page by page, crawl the full catalog crawl")
+        parser.add_argument("--albums", type=int, default=200)
+        parser.add_argument("--tracks-per-album", type=int, default=12)
+        parser.add_argument("--artists", type=int, default=300)
+        parser.add_argument("--page-size", type=int, default=20)
+        parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every fake response")
+        parser.add_argument("--error-rate", type=float, default=0.0)
+        parser.add_argument("--throttle-rate", type=float, default=0.0)
+        parser.add_argument("--use-cache", action="store_true", help="Keep the on-disk response cache enabled")
+        parser.add_argument("--keep", action="store_true", help="Keep the ingested rows instead of rolling back")
+
+    def ingest(self, options):
+        if options["mode"] == "crawl":
+            crawler = CatalogCrawler("benchmark")
+            crawler.restart()
+            crawler.run(log=lambda message: None)
+            return
+
+        headers = token_provider.get_headers()
+        for offset in range(0, options["albums"], options["page_size"]):
+            page = AlbumService.fetch_new_releases(options["page_size"], offset, headers)
+            AlbumService.fetch_albums_from_api(page, headers)
+
+    def handle(self, *args, **options):
+        catalog = FakeCatalog(options["albums"], options["tracks_per_album"], options["artists"])
+        server = FakeSpotifyServer(catalog, latency=options["latency"], error_rate=options["error_rate"],
+                                    throttle_rate=options["throttle_rate"]).start()
+
+        # point the shared client and token provider at the fake server for the duration of the run
+        saved = (spotify_client.base_url, spotify_client.cache, token_provider.auth_url)
+        spotify_client.base_url, token_provider.auth_url = server.api_url, server.auth_url
+        if not options["use_cache"]:
+            spotify_client.cache = None
+        token_provider.invalidate()
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                try:
+                    with transaction.atomic():
+                        self.ingest(options)
+                        if not options["keep"]:
+                            raise Rollback()
+                except Rollback:
+                    pass
+            elapsed = time.perf_counter() - started
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            server.stop()
+            spotify_client.base_url, spotify_client.cache, token_provider.auth_url = saved
+            token_provider.invalidate()
+
+        albums = options["albums"]
+        http_calls = sum(server.calls.values())
+        self.stdout.write("mode:               {}".format(options["mode"]))
+        self.stdout.write("albums:             {} ({} tracks)".format(albums, albums * options["tracks_per_album"]))
+        self.stdout.write("elapsed:            {:.2f} s".format(elapsed))
+        self.stdout.write("albums/sec:         {:.1f}".format(albums / elapsed if elapsed else 0))
+        self.stdout.write("http calls/album:   {:.2f} {}".format(http_calls / albums, dict(server.calls)))
+        self.stdout.write("db queries/album:   {:.2f}".format(len(queries) / albums))
+        self.stdout.write("peak memory:        {:.1f} MB".format(peak / (1024 * 1024)))
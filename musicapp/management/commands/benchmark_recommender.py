@@ -0,0 +1,90 @@
+import random, time
+import numpy as np
+import scipy.sparse as sp
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from musicapp.models import UserFactor
+from musicapp.recommender import ALSModel, Recommender, top_items
+
+
+class Command(BaseCommand):
+    help = "Benchmark recommender training and scoring on synthetic ratings, and serving from the stored model"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ratings", type=int, default=1000000)
+        parser.add_argument("--users", type=int, default=50000)
+        parser.add_argument("--tracks", type=int, default=20000)
+        parser.add_argument("--factors", type=int, default=32)
+        parser.add_argument("--iterations", type=int, default=10)
+        parser.add_argument("--requests", type=int, default=1000, help="Recommendation requests timed after training")
+        parser.add_argument("--limit", type=int, default=20)
+        parser.add_argument("--skip-training", action="store_true", help="Only time serving from the stored model")
+
+    def synthetic_ratings(self, options):
+        ''' Ratings from hidden user and track tastes, with popular tracks rated more often '''
+        random = np.random.RandomState(42)
+        users = random.randint(0, options["users"], options["ratings"])
+        tracks = np.minimum(random.zipf(1.3, options["ratings"]) - 1, options["tracks"] - 1)
+        user_taste = random.normal(size=(options["users"], 4))
+        track_taste = random.normal(size=(options["tracks"], 4))
+        affinity = np.einsum("ij,ij->i", user_taste[users], track_taste[tracks])
+        ratings = np.clip(np.round(3 + affinity + random.normal(scale=0.5, size=options["ratings"])), 1, 5)
+        matrix = sp.coo_matrix((ratings, (users, tracks)), shape=(options["users"], options["tracks"])).tocsr()
+        # repeated user and track pairs are summed by the conversion, clip them back to the rating scale
+        matrix.data = np.clip(matrix.data, 1, 5)
+        return matrix
+
+    def percentiles(self, latencies):
+        return "p50 {:.3f} ms, p99 {:.3f} ms".format(np.percentile(latencies, 50), np.percentile(latencies, 99))
+
+    def benchmark_training(self, options):
+        ratings = self.synthetic_ratings(options)
+        self.stdout.write("{} users, {} tracks, {} ratings".format(ratings.shape[0], ratings.shape[1], ratings.nnz))
+
+        started = time.monotonic()
+        model = ALSModel(options["factors"], iterations=options["iterations"]).fit(ratings)
+        training = time.monotonic() - started
+
+        # the in-memory ranking alone, without the factor and rating reads of a request
+        random = np.random.RandomState(7)
+        latencies = []
+        for user in random.randint(0, ratings.shape[0], options["requests"]):
+            rated = ratings.indices[ratings.indptr[user]:ratings.indptr[user + 1]]
+            started = time.monotonic()
+            top_items(model.item_factors, model.user_factors[user], rated, options["limit"], model.global_mean)
+            latencies.append((time.monotonic() - started) * 1000)
+
+        factor_bytes = model.item_factors.nbytes + model.user_factors.nbytes
+        self.stdout.write("training: {:.1f} s ({:.2f} s/iteration)".format(training, training / options["iterations"]))
+        self.stdout.write("scoring: " + self.percentiles(latencies))
+        self.stdout.write("factors: {:.1f} MB".format(factor_bytes / 2 ** 20))
+
+    def benchmark_serving(self, options):
+        ''' Recommender.recommend as the recommend api calls it, against the model saved by train_recommender '''
+        started = time.monotonic()
+        recommender = Recommender.current()
+        if recommender is None:
+            self.stdout.write(self.style.WARNING("serving: no stored model, run train_recommender first"))
+            return
+        loading = (time.monotonic() - started) * 1000
+
+        user_ids = list(UserFactor.objects.filter(model_id=recommender.uid).values_list("user_id", flat=True))
+        sample = random.Random(7)
+        latencies, queries = [], 0
+        for _ in range(options["requests"]):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.monotonic()
+                recommender.recommend(sample.choice(user_ids), options["limit"])
+                latencies.append((time.monotonic() - started) * 1000)
+            queries += len(captured)
+
+        self.stdout.write("serving: {} users, {} tracks, model loaded in {:.1f} ms".format(
+                                len(user_ids), len(recommender.item_ids), loading))
+        self.stdout.write("serving: {}, {:.1f} queries/request".format(self.percentiles(latencies),
+                                                                       queries / len(latencies)))
+
+    def handle(self, *args, **options):
+        if not options["skip_training"]:
+            self.benchmark_training(options)
+        self.benchmark_serving(options)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from musicapp.similarity import SimilarTracksBuilder
+
+
+class Command(BaseCommand):
+    help = "Precompute the content based top-k similar tracks of every song track"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top-k", type=int, default=10)
+        parser.add_argument("--block-size", type=int, default=2000, help="Tracks multiplied per sparse block")
+        parser.add_argument("--min-score", type=float, default=0.05, help="Smallest cosine similarity kept")
+
+    def handle(self, *args, **options):
+        builder = SimilarTracksBuilder(options["top_k"], options["block_size"], options["min_score"])
+        written = builder.run(log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS("{} similar track rows written".format(written)))
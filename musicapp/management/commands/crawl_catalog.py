@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from musicapp.cache import CatalogCache
+from musicapp.crawler import CatalogCrawler
+from MusicProj.settings import CRAWL_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "Crawl the whole Spotify new-releases catalog, resuming from the last saved checkpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--name", default="new-releases", help="Checkpoint name of the crawl")
+        parser.add_argument("--chunk-size", type=int, default=CRAWL_CHUNK_SIZE, help="Albums persisted per chunk")
+        parser.add_argument("--restart", action="store_true", help="Discard the checkpoint and crawl from the start")
+
+    def handle(self, *args, **options):
+        CatalogCache.require_shared_backend()
+        crawler = CatalogCrawler(options["name"], options["chunk_size"])
+        if options["restart"]:
+            crawler.restart()
+
+        checkpoint = crawler.run(log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS("Crawl {} finished, {} albums and {} tracks stored".format(
+                                checkpoint.name, checkpoint.albums_done, checkpoint.tracks_done)))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from musicapp.fake_spotify import FakeCatalog, FakeSpotifyServer
+
+
+class Command(BaseCommand):
+    help = "Serve a synthetic Spotify catalog locally, point SPOTIFY_BASE_URL/SPOTIFY_AUTH_URL at it"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8900)
+        parser.add_argument("--albums", type=int, default=200)
+        parser.add_argument("--tracks-per-album", type=int, default=12)
+        parser.add_argument("--artists", type=int, default=300)
+        parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 500")
+        parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with a 429")
+
+    def handle(self, *args, **options):
+        catalog = FakeCatalog(options["albums"], options["tracks_per_album"], options["artists"])
+        server = FakeSpotifyServer(catalog, options["host"], options["port"], options["latency"],
+                                    options["error_rate"], options["throttle_rate"])
+        self.stdout.write("SPOTIFY_BASE_URL={}".format(server.api_url))
+        self.stdout.write("SPOTIFY_AUTH_URL={}".format(server.auth_url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
@@ -0,0 +1,31 @@
+import os, socket
+from django.core.management.base import BaseCommand
+from musicapp.cache import CatalogCache
+from musicapp.jobs import IngestionJobRunner, IngestionQueue
+from musicapp.models import IngestionJob
+
+
+class Command(BaseCommand):
+    help = "Claim and run queued Spotify ingestion jobs, several workers can run on several hosts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--worker-id", default="{}-{}".format(socket.gethostname(), os.getpid()))
+        parser.add_argument("--poll-interval", type=float, default=5)
+        parser.add_argument("--max-jobs", type=int, default=None)
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is drained")
+        parser.add_argument("--new-releases", type=int, default=0, metavar="PAGES",
+                            help="Queue this many new-releases pages before working")
+        parser.add_argument("--limit", type=int, default=20, help="Albums per new-releases page")
+        parser.add_argument("--refresh-artists", action="store_true", help="Queue batches refreshing every stored artist")
+
+    def handle(self, *args, **options):
+        CatalogCache.require_shared_backend()
+        for page in range(options["new_releases"]):
+            IngestionQueue.enqueue(IngestionJob.NEW_RELEASES, {"limit": options["limit"], "offset": page * options["limit"]},
+                                    unique=True)
+        if options["refresh_artists"]:
+            IngestionJobRunner.enqueue_artist_refresh()
+
+        processed = IngestionJobRunner.work(options["worker_id"], options["poll_interval"], options["max_jobs"],
+                                            options["once"], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS("{} jobs processed by {}".format(processed, options["worker_id"])))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from musicapp.services import PlaylistService
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored track count, duration and genre stats of every playlist"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        rebuilt = PlaylistService.rebuild_stats(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS("{} playlists rebuilt".format(rebuilt)))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from musicapp.recommender import RecommenderTrainer
+
+
+class Command(BaseCommand):
+    help = "Train the collaborative filtering recommender from the user ratings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--factors", type=int, default=32)
+        parser.add_argument("--regularization", type=float, default=0.1)
+        parser.add_argument("--iterations", type=int, default=10)
+
+    def handle(self, *args, **options):
+        trainer = RecommenderTrainer(options["factors"], options["regularization"], options["iterations"])
+        recommender = trainer.run(log=self.stdout.write)
+        if recommender is None:
+            self.stdout.write(self.style.WARNING("No ratings to train on"))
+            return
+        self.stdout.write(self.style.SUCCESS("Recommender model {} saved".format(recommender.uid)))
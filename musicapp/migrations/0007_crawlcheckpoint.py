@@ -0,0 +1,28 @@
+# Generated by Django 3.0.8 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musicapp', '0006_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlCheckpoint',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('page_url', models.TextField(blank=True, null=True)),
+                ('page_index', models.IntegerField(default=0)),
+                ('albums_done', models.IntegerField(default=0)),
+                ('tracks_done', models.IntegerField(default=0)),
+                ('finished', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'crawl_checkpoints',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.8 on 2026-10-18 11:00
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musicapp', '0007_crawlcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='songtrack',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='songtrack',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='song_track_search_idx'),
+        ),
+        migrations.RunSQL(
+            """UPDATE song_track SET search_vector =
+                setweight(to_tsvector('simple', coalesce(song_track.name, '')), 'A') ||
+                setweight(to_tsvector('simple', array_to_string(song_track.artists, ' ')), 'B') ||
+                setweight(to_tsvector('simple', array_to_string(song_track.genres, ' ')), 'C') ||
+                setweight(to_tsvector('simple', coalesce((SELECT string_agg(album.name, ' ') FROM albums_tracks AS album_track
+                    JOIN albums AS album ON album.id = album_track.album_id WHERE album_track.songtrack_id = song_track.id), '')), 'D')""",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
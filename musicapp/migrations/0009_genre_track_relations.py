@@ -0,0 +1,87 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:00
+
+from collections import Counter
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_relations(apps, schema_editor):
+    """
+    Split the comma joined genre strings of every track into Genre rows, link tracks to the artists
+    whose name is unambiguous, and give artists the genres of the tracks they perform alone
+    """
+    SongTrack = apps.get_model('musicapp', 'SongTrack')
+    Artist = apps.get_model('musicapp', 'Artist')
+    Genre = apps.get_model('musicapp', 'Genre')
+    TrackGenre = SongTrack.track_genres.through
+    TrackArtist = SongTrack.track_artists.through
+    ArtistGenre = Artist.genres.through
+
+    name_counts = Counter(Artist.objects.values_list('name', flat=True))
+    artist_ids = {name: artist_id for artist_id, name in Artist.objects.values_list('id', 'name') if name_counts[name] == 1}
+
+    genre_ids = {}
+    def genre_id(name):
+        if name not in genre_ids:
+            genre_ids[name] = Genre.objects.get_or_create(name=name)[0].pk
+        return genre_ids[name]
+
+    track_genres, track_artists, artist_genres = [], [], set()
+    for track in SongTrack.objects.only('id', 'artists', 'genres').iterator():
+        genres = sorted({genre.strip() for value in track.genres or [] for genre in (value or '').split(',') if genre.strip()})
+        if genres != (track.genres or []):
+            SongTrack.objects.filter(id=track.id).update(genres=genres)
+
+        linked_artists = [artist_ids[name] for name in dict.fromkeys(track.artists or []) if name in artist_ids]
+        track_genres.extend(TrackGenre(songtrack_id=track.id, genre_id=genre_id(genre)) for genre in genres)
+        track_artists.extend(TrackArtist(songtrack_id=track.id, artist_id=artist_id) for artist_id in linked_artists)
+        if len(track.artists or []) == 1 and linked_artists:
+            artist_genres.update((linked_artists[0], genre_id(genre)) for genre in genres)
+
+        if len(track_genres) + len(track_artists) >= BATCH_SIZE:
+            TrackGenre.objects.bulk_create(track_genres, batch_size=BATCH_SIZE, ignore_conflicts=True)
+            TrackArtist.objects.bulk_create(track_artists, batch_size=BATCH_SIZE, ignore_conflicts=True)
+            track_genres, track_artists = [], []
+
+    TrackGenre.objects.bulk_create(track_genres, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    TrackArtist.objects.bulk_create(track_artists, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    ArtistGenre.objects.bulk_create([ArtistGenre(artist_id=artist_id, genre_id=genre_pk) for artist_id, genre_pk in artist_genres],
+                                    batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musicapp', '0008_songtrack_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=500, unique=True)),
+            ],
+            options={
+                'db_table': 'genres',
+            },
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='genres',
+            field=models.ManyToManyField(blank=True, related_name='artists', to='musicapp.Genre'),
+        ),
+        migrations.AddField(
+            model_name='songtrack',
+            name='track_artists',
+            field=models.ManyToManyField(blank=True, related_name='tracks', to='musicapp.Artist'),
+        ),
+        migrations.AddField(
+            model_name='songtrack',
+            name='track_genres',
+            field=models.ManyToManyField(blank=True, related_name='tracks', to='musicapp.Genre'),
+        ),
+        migrations.RunPython(backfill_relations, migrations.RunPython.noop),
+    ]
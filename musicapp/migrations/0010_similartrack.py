@@ -0,0 +1,28 @@
+# Generated by Django 3.0.8 on 2026-10-18 13:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musicapp', '0009_genre_track_relations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarTrack',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.SmallIntegerField()),
+                ('score', models.FloatField()),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='musicapp.SongTrack')),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_tracks', to='musicapp.SongTrack')),
+            ],
+            options={
+                'db_table': 'similar_tracks',
+                'unique_together': {('track', 'rank')},
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.0.8 on 2026-10-18 13:30
+
+from django.conf import settings
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('musicapp', '0010_similartrack'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommenderModel',
+            fields=[
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('factors', models.IntegerField()),
+                ('global_mean', models.FloatField(default=0.0)),
+                ('item_ids', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=100), default=list, size=None)),
+                ('item_factors', models.BinaryField()),
+                ('training_ms', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'recommender_models',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserFactor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vector', models.BinaryField()),
+                ('model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_factors', to='musicapp.RecommenderModel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'recommender_user_factors',
+                'unique_together': {('model', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 3.0.8 on 2026-10-18 14:00
+
+from django.db import migrations, models
+from django.db.models import Count
+import random
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_facets(apps, schema_editor):
+    """
+    Count the tracks of every genre, artist and album that has any
+    """
+    SongTrack = apps.get_model('musicapp', 'SongTrack')
+    Album = apps.get_model('musicapp', 'Album')
+    CatalogFacet = apps.get_model('musicapp', 'CatalogFacet')
+    links = (
+        ('genre', SongTrack.track_genres.through, 'genre_id'),
+        ('artist', SongTrack.track_artists.through, 'artist_id'),
+        ('album', Album.tracks.through, 'album_id'),
+    )
+    for kind, through, column in links:
+        counts = through.objects.values_list(column).annotate(track_count=Count('songtrack_id')).order_by()
+        CatalogFacet.objects.bulk_create((CatalogFacet(id='{}:{}'.format(kind, object_id), kind=kind, object_id=str(object_id),
+                                                       track_count=track_count, sort_key=random.random())
+                                          for object_id, track_count in counts.iterator()), batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musicapp', '0011_recommendermodel_userfactor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogFacet',
+            fields=[
+                ('id', models.CharField(editable=False, max_length=150, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('genre', 'Genre'), ('artist', 'Artist'), ('album', 'Album')], max_length=20)),
+                ('object_id', models.CharField(max_length=100)),
+                ('track_count', models.IntegerField(default=0)),
+                ('sort_key', models.FloatField(default=random.random)),
+            ],
+            options={
+                'db_table': 'catalog_facets',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='catalogfacet',
+            index=models.Index(fields=['kind', 'sort_key'], name='catalog_facet_sample_idx'),
+        ),
+        # track sampling walked the tracks of one genre or artist in songtrack id order, albums_tracks was
+        # covered by its (album_id, songtrack_id) unique index. 0015 replaces these with link id indexes
+        migrations.RunSQL(
+            'CREATE INDEX song_track_genres_sample_idx ON song_track_track_genres (genre_id, songtrack_id)',
+            'DROP INDEX song_track_genres_sample_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX song_track_artists_sample_idx ON song_track_track_artists (artist_id, songtrack_id)',
+            'DROP INDEX song_track_artists_sample_idx',
+        ),
+        migrations.RunPython(backfill_facets, migrations.RunPython.noop),
+    ]
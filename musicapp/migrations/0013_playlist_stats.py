@@ -0,0 +1,58 @@
+# Generated by Django 3.0.8 on 2026-10-18 15:00
+
+from collections import Counter
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+TOP_GENRES = 5
+
+
+def backfill_stats(apps, schema_editor):
+    """
+    Aggregate the track count, duration and genres of every existing playlist
+    """
+    PlayList = apps.get_model('musicapp', 'PlayList')
+    stats = {}
+    rows = PlayList.tracks.through.objects.values_list('playlist_id', 'songtrack__duration_ms', 'songtrack__genres')
+    for playlist_id, duration_ms, genres in rows.iterator():
+        track_count, total_duration_ms, genre_counts = stats.setdefault(playlist_id, [0, 0, Counter()])
+        stats[playlist_id][:2] = [track_count + 1, total_duration_ms + (duration_ms or 0)]
+        genre_counts.update(set(genres or []))
+
+    for playlist_id, (track_count, total_duration_ms, genre_counts) in stats.items():
+        PlayList.objects.filter(uid=playlist_id).update(
+            track_count=track_count, total_duration_ms=total_duration_ms, genre_counts=dict(genre_counts),
+            top_genres=[genre for genre, _ in sorted(genre_counts.items(), key=lambda item: (-item[1], item[0]))[:TOP_GENRES]])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musicapp', '0012_catalogfacet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='track_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='total_duration_ms',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='genre_counts',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='top_genres',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=500), blank=True, default=list, editable=False, size=None),
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.8 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musicapp', '0013_playlist_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='unique_key',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='ingestionjob',
+            constraint=models.UniqueConstraint(condition=models.Q(status__in=['pending', 'running']), fields=('unique_key',), name='ingestion_job_unique_active'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.0.8 on 2026-10-19 12:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musicapp', '0014_ingestionjob_unique_key'),
+    ]
+
+    # track sampling takes the min and max link id of one genre, artist or album and walks its links in id
+    # order from a random pivot, these replace the (facet, songtrack_id) indexes of 0012
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX song_track_genres_link_idx ON song_track_track_genres (genre_id, id)',
+            'DROP INDEX song_track_genres_link_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX song_track_artists_link_idx ON song_track_track_artists (artist_id, id)',
+            'DROP INDEX song_track_artists_link_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX albums_tracks_link_idx ON albums_tracks (album_id, id)',
+            'DROP INDEX albums_tracks_link_idx',
+        ),
+        migrations.RunSQL(
+            'DROP INDEX song_track_genres_sample_idx',
+            'CREATE INDEX song_track_genres_sample_idx ON song_track_track_genres (genre_id, songtrack_id)',
+        ),
+        migrations.RunSQL(
+            'DROP INDEX song_track_artists_sample_idx',
+            'CREATE INDEX song_track_artists_sample_idx ON song_track_track_artists (artist_id, songtrack_id)',
+        ),
+    ]
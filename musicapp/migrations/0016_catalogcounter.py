@@ -0,0 +1,33 @@
+# Generated by Django 3.0.8 on 2026-10-19 15:00
+
+from django.core.management import call_command
+from django.db import migrations, models
+
+
+def create_cache_table(apps, schema_editor):
+    """
+    The default DatabaseCache carries the catalog change sets between processes, create its table with the
+    schema instead of relying on a manual createcachetable. A no-op for other cache backends
+    """
+    call_command('createcachetable', database=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('musicapp', '0015_facet_link_sample_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogCounter',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'catalog_counters',
+            },
+        ),
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,24 @@
+import random
 from django.db import models
+from django.utils import timezone
 from authentication.models import BaseModel, User
-from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 # Create your models here.
 
+class Genre(models.Model):
+    """A ORM for music genres"""
+
+    name = models.CharField(max_length=500, unique=True)
+
+    class Meta:
+        """A meta object for defining genres table"""
+
+        db_table = "genres"
+
+
 class SongTrack(models.Model):
     """A ORM for song tracks interactions"""
     
@@ -13,11 +28,18 @@ class SongTrack(models.Model):
     artists = ArrayField(models.CharField(max_length=500, null=True, blank=True), default=list, blank=True)
     genres = ArrayField(models.CharField(max_length=500, null=True, blank=True), default=list, blank=True)
     external_urls = models.CharField(max_length=100, null=True, blank=True)
+    track_artists = models.ManyToManyField("Artist", blank=True, related_name="tracks")
+    track_genres = models.ManyToManyField(Genre, blank=True, related_name="tracks")
+    # weighted name, artists, genres and album names, maintained by the ingestion persistence stage
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
 
     class Meta:
         """A meta object for defining song tracks table"""
 
         db_table = "song_track"
+        indexes = [
+            GinIndex(fields=["search_vector"], name="song_track_search_idx"),
+        ]
 
 
 class Album(models.Model):
@@ -45,6 +67,7 @@ class Artist(models.Model):
     name = models.CharField(max_length=1000, null=True, blank=True)
     external_urls = models.CharField(max_length=100, null=True, blank=True)
     popularity = models.CharField(max_length=100, null=True, blank=True)
+    genres = models.ManyToManyField(Genre, blank=True, related_name="artists")
 
     class Meta:
         """A meta object for defining Artist table"""
@@ -63,6 +86,11 @@ class PlayList(BaseModel):
     playlist_name = models.CharField(max_length=200, null=True, blank=True)
     description = models.TextField(null=True, blank=True)
     tracks = models.ManyToManyField(SongTrack, blank=True)
+    # aggregates of the tracks, maintained by PlaylistService on every track change
+    track_count = models.IntegerField(default=0, editable=False)
+    total_duration_ms = models.BigIntegerField(default=0, editable=False)
+    genre_counts = JSONField(default=dict, blank=True, editable=False)
+    top_genres = ArrayField(models.CharField(max_length=500), default=list, blank=True, editable=False)
 
     class Meta:
         """A meta object for defining Music PlayList table"""
@@ -84,4 +112,170 @@ class UserRatings(BaseModel):
     class Meta:
         """A meta object for defining user ratings on a song track table"""
 
-        db_table = "user_ratings"
\ No newline at end of file
+        db_table = "user_ratings"
+
+class IngestionJob(BaseModel):
+    """A ORM for the queued Spotify ingestion jobs"""
+
+    NEW_RELEASES = "new_releases"
+    ALBUM_TRACKS = "album_tracks"
+    ARTIST_BATCH = "artist_batch"
+    JOB_TYPES = (
+        (NEW_RELEASES, "New releases page"),
+        (ALBUM_TRACKS, "Album tracks page"),
+        (ARTIST_BATCH, "Artist batch"),
+    )
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    job_type = models.CharField(max_length=50, choices=JOB_TYPES)
+    payload = JSONField(default=dict, blank=True)
+    # digest of job_type and payload for jobs queued with unique=True, at most one of them waits or runs at a time
+    unique_key = models.CharField(max_length=64, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=200, null=True, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.IntegerField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        """A meta object for defining ingestion jobs table"""
+
+        db_table = "ingestion_jobs"
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="ingestion_job_claim_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["unique_key"], condition=models.Q(status__in=["pending", "running"]),
+                                    name="ingestion_job_unique_active"),
+        ]
+
+
+class CrawlCheckpoint(models.Model):
+    """A ORM for the resume position of a full catalog crawl"""
+
+    name = models.CharField(primary_key=True, max_length=100)
+    page_url = models.TextField(null=True, blank=True)
+    page_index = models.IntegerField(default=0)
+    albums_done = models.IntegerField(default=0)
+    tracks_done = models.IntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        """A meta object for defining crawl checkpoints table"""
+
+        db_table = "crawl_checkpoints"
+
+
+class CatalogCounter(models.Model):
+    """A ORM for the catalog version counter shared by the web workers and the ingestion processes"""
+
+    name = models.CharField(primary_key=True, max_length=100)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        """A meta object for defining catalog counters table"""
+
+        db_table = "catalog_counters"
+
+
+class SimilarTrack(models.Model):
+    """A ORM for the precomputed content based neighbours of a song track"""
+
+    track = models.ForeignKey(SongTrack, on_delete=models.CASCADE, related_name="similar_tracks")
+    similar = models.ForeignKey(SongTrack, on_delete=models.CASCADE, related_name="+")
+    rank = models.SmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        """A meta object for defining similar tracks table"""
+
+        db_table = "similar_tracks"
+        unique_together = (("track", "rank"),)
+
+
+class RecommenderModel(BaseModel):
+    """A ORM for a trained matrix factorization model of the user ratings"""
+
+    factors = models.IntegerField()
+    global_mean = models.FloatField(default=0.0)
+    item_ids = ArrayField(models.CharField(max_length=100), default=list)
+    # float32 item factor matrix saved in .npy format, one row per entry of item_ids
+    item_factors = models.BinaryField()
+    training_ms = models.IntegerField(default=0)
+
+    class Meta:
+        """A meta object for defining recommender models table"""
+
+        db_table = "recommender_models"
+
+
+class UserFactor(models.Model):
+    """A ORM for the latent factors of a user in a recommender model"""
+
+    model = models.ForeignKey(RecommenderModel, on_delete=models.CASCADE, related_name="user_factors")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    vector = models.BinaryField()
+
+    class Meta:
+        """A meta object for defining user factors table"""
+
+        db_table = "recommender_user_factors"
+        unique_together = (("model", "user"),)
+
+
+class CatalogFacet(models.Model):
+    """A ORM for the genres, artists and albums having tracks, with their track counts"""
+
+    GENRE = "genre"
+    ARTIST = "artist"
+    ALBUM = "album"
+    KINDS = (
+        (GENRE, "Genre"),
+        (ARTIST, "Artist"),
+        (ALBUM, "Album"),
+    )
+
+    # "<kind>:<object id>"
+    id = models.CharField(primary_key=True, max_length=150, editable=False)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    object_id = models.CharField(max_length=100)
+    track_count = models.IntegerField(default=0)
+    # uniform random position used to sample a facet with a single index lookup
+    sort_key = models.FloatField(default=random.random)
+
+    class Meta:
+        """A meta object for defining catalog facets table"""
+
+        db_table = "catalog_facets"
+        indexes = [
+            models.Index(fields=["kind", "sort_key"], name="catalog_facet_sample_idx"),
+        ]
+
+    @classmethod
+    def links(cls, kind):
+        """The through table linking song tracks to facets of the kind, and its facet column"""
+        return {
+            cls.GENRE: (SongTrack.track_genres.through, "genre_id"),
+            cls.ARTIST: (SongTrack.track_artists.through, "artist_id"),
+            cls.ALBUM: (Album.tracks.through, "album_id"),
+        }[kind]
+
+    @classmethod
+    def owner_model(cls, kind):
+        return {cls.GENRE: Genre, cls.ARTIST: Artist, cls.ALBUM: Album}[kind]
@@ -0,0 +1,156 @@
+from functools import partial
+from django.db import connection, transaction
+from django.db.models import Count
+from base.utils import chunked
+from .cache import CatalogCache
+from .constants import *
+from .models import *
+from MusicProj.settings import INGESTION_BATCH_SIZE
+
+
+def bulk_upsert(model, objs, batch_size=INGESTION_BATCH_SIZE, exclude=(), keep=()):
+    ''' Insert the given model instances, updating every column of the rows whose primary key already exists.
+        Runs one INSERT ... ON CONFLICT statement per batch of batch_size rows, the `exclude`d fields are left alone
+        and the `keep` fields are only written by inserts
+    '''
+    # a single statement can't touch the same row twice, keep the last instance of every primary key
+    objs = list({obj.pk: obj for obj in objs}.values())
+    if not objs:
+        return
+
+    quote_name = connection.ops.quote_name
+    fields = [field for field in model._meta.concrete_fields if field.name not in exclude]
+    pk_column = model._meta.pk.column
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    updates = ", ".join("{column} = EXCLUDED.{column}".format(column=quote_name(field.column))
+                            for field in fields if field.column != pk_column and field.name not in keep)
+    row_placeholder = "(" + ", ".join(["%s"] * len(fields)) + ")"
+
+    with connection.cursor() as cursor:
+        for batch in chunked(objs, batch_size):
+            sql = "INSERT INTO {table} ({columns}) VALUES {values} ON CONFLICT ({pk}) DO UPDATE SET {updates}".format(
+                    table=quote_name(model._meta.db_table), columns=columns,
+                    values=", ".join([row_placeholder] * len(batch)), pk=quote_name(pk_column), updates=updates)
+            params = [field.get_db_prep_save(getattr(obj, field.attname), connection) for obj in batch for field in fields]
+            cursor.execute(sql, params)
+
+
+# persistence stage writing a whole parsed page of the Spotify catalog in bulk
+class CatalogWriter:
+    @classmethod
+    def model_fields(cls, model, data):
+        ''' Keep the keys of a parsed dict that are concrete columns of the model '''
+        columns = {field.attname for field in model._meta.concrete_fields}
+        return {key: value for key, value in data.items() if key in columns}
+
+
+    @classmethod
+    def save_genres(cls, names, batch_size=INGESTION_BATCH_SIZE):
+        ''' Make sure the genres exist and return their ids by name '''
+        names = set(names)
+        Genre.objects.bulk_create([Genre(name=name) for name in names], batch_size=batch_size, ignore_conflicts=True)
+        return dict(Genre.objects.filter(name__in=names).values_list("name", "id"))
+
+
+    @classmethod
+    def replace_links(cls, through, owner_field, owner_ids, links, batch_size=INGESTION_BATCH_SIZE):
+        ''' Swap the through table rows of the given owners for the new links '''
+        through.objects.filter(**{owner_field + "__in": list(owner_ids)}).delete()
+        through.objects.bulk_create(links, batch_size=batch_size, ignore_conflicts=True)
+
+
+    @classmethod
+    def save_artists(cls, artists, batch_size=INGESTION_BATCH_SIZE):
+        bulk_upsert(Artist, [Artist(**cls.model_fields(Artist, artist)) for artist in artists], batch_size)
+
+        genre_ids = cls.save_genres([genre for artist in artists for genre in artist.get("genres", [])], batch_size)
+        links = [Artist.genres.through(artist_id=artist["id"], genre_id=genre_ids[genre])
+                    for artist in artists for genre in set(artist.get("genres", []))]
+        cls.replace_links(Artist.genres.through, "artist_id", [artist["id"] for artist in artists], links, batch_size)
+        transaction.on_commit(partial(CatalogCache.bump_version, {"artists": [artist["id"] for artist in artists]}))
+
+
+    @classmethod
+    def save_albums(cls, albums, batch_size=INGESTION_BATCH_SIZE):
+        album_objs = [Album(**cls.model_fields(Album, album)) for album in albums]
+        album_ids = [album.id for album in album_objs]
+        existing = dict(Album.objects.filter(id__in=album_ids).values_list("id", "name"))
+        bulk_upsert(Album, album_objs, batch_size)
+
+        # the search vectors of tracks embed their album names
+        renamed = [album.id for album in album_objs if album.id in existing and existing[album.id] != album.name]
+        if renamed:
+            cls.refresh_search_vectors(list(Album.tracks.through.objects.filter(album_id__in=renamed)
+                                                .values_list("songtrack_id", flat=True)), batch_size)
+        transaction.on_commit(partial(CatalogCache.bump_version, {
+            "albums": album_ids, "new_albums": [album_id for album_id in album_ids if album_id not in existing]}))
+
+
+    @classmethod
+    def save_tracks(cls, album_tracks, batch_size=INGESTION_BATCH_SIZE):
+        ''' Persist parsed track dicts keyed by the id of their (already stored) album, linking them to their
+            stored artists and to their genres
+        '''
+        tracks = {track["id"]: track for album_id, album_track_list in album_tracks.items() for track in album_track_list}
+        links = [Album.tracks.through(album_id=album_id, songtrack_id=track["id"])
+                    for album_id, album_track_list in album_tracks.items() for track in album_track_list]
+
+        bulk_upsert(SongTrack, [SongTrack(**cls.model_fields(SongTrack, track)) for track in tracks.values()], batch_size,
+                    exclude=("search_vector",))
+        Album.tracks.through.objects.bulk_create(links, batch_size=batch_size, ignore_conflicts=True)
+
+        stored_artists = set(Artist.objects.filter(id__in={artist_id for track in tracks.values()
+                                for artist_id in track.get("artist_ids", [])}).values_list("id", flat=True))
+        artist_links = [SongTrack.track_artists.through(songtrack_id=track_id, artist_id=artist_id)
+                            for track_id, track in tracks.items() for artist_id in dict.fromkeys(track.get("artist_ids", []))
+                            if artist_id in stored_artists]
+        old_artists = set(SongTrack.track_artists.through.objects.filter(songtrack_id__in=list(tracks))
+                            .values_list("artist_id", flat=True))
+        cls.replace_links(SongTrack.track_artists.through, "songtrack_id", tracks, artist_links, batch_size)
+
+        genre_ids = cls.save_genres([genre for track in tracks.values() for genre in track.get("genres", [])], batch_size)
+        genre_links = [SongTrack.track_genres.through(songtrack_id=track_id, genre_id=genre_ids[genre])
+                            for track_id, track in tracks.items() for genre in set(track.get("genres", []))]
+        old_genres = set(SongTrack.track_genres.through.objects.filter(songtrack_id__in=list(tracks))
+                            .values_list("genre_id", flat=True))
+        cls.replace_links(SongTrack.track_genres.through, "songtrack_id", tracks, genre_links, batch_size)
+
+        cls.refresh_search_vectors(list(tracks), batch_size)
+        cls.refresh_facets(CatalogFacet.ALBUM, album_tracks, batch_size)
+        cls.refresh_facets(CatalogFacet.ARTIST, old_artists | {link.artist_id for link in artist_links}, batch_size)
+        cls.refresh_facets(CatalogFacet.GENRE, old_genres | {link.genre_id for link in genre_links}, batch_size)
+        transaction.on_commit(partial(CatalogCache.bump_version, {"tracks": list(tracks), "albums": list(album_tracks)}))
+
+
+    @classmethod
+    def refresh_search_vectors(cls, track_ids, batch_size=INGESTION_BATCH_SIZE):
+        ''' Rebuild the full text search vector of the given tracks from their own and their albums' names '''
+        sql = SEARCH_VECTOR_SQL.format(config=SEARCH_CONFIG, track_table=SongTrack._meta.db_table,
+                    album_table=Album._meta.db_table, through_table=Album.tracks.through._meta.db_table)
+        with connection.cursor() as cursor:
+            for batch in chunked(list(dict.fromkeys(track_ids)), batch_size):
+                cursor.execute(sql + " WHERE song_track.id = ANY(%s)", [batch])
+
+
+    @classmethod
+    def refresh_facets(cls, kind, object_ids, batch_size=INGESTION_BATCH_SIZE):
+        ''' Recount the tracks of the given genres, artists or albums, dropping the facets left without any '''
+        through, column = CatalogFacet.links(kind)
+        for batch in chunked(list(object_ids), batch_size):
+            counts = dict(through.objects.filter(**{column + "__in": batch}).values_list(column)
+                            .annotate(track_count=Count("songtrack_id")).order_by())
+            # the random sort_key of an existing facet is kept, new facets draw their own
+            bulk_upsert(CatalogFacet, [CatalogFacet(id="{}:{}".format(kind, object_id), kind=kind, object_id=str(object_id),
+                                                    track_count=track_count) for object_id, track_count in counts.items()],
+                        batch_size, keep=("sort_key",))
+            CatalogFacet.objects.filter(kind=kind, object_id__in=[str(object_id) for object_id in batch
+                                                                  if object_id not in counts]).delete()
+
+
+    @classmethod
+    def save_page(cls, albums, artists, batch_size=INGESTION_BATCH_SIZE):
+        ''' Persist parsed album dicts (each carrying its parsed "tracks") and artist dicts '''
+        with transaction.atomic():
+            cls.save_artists(artists, batch_size)
+            cls.save_albums(albums, batch_size)
+            cls.save_tracks({album["id"]: album.get("tracks", []) for album in albums}, batch_size)
@@ -0,0 +1,157 @@
+import io
+import threading
+import time
+import numpy as np
+import scipy.sparse as sp
+from django.db import transaction
+from .models import *
+from MusicProj.settings import INGESTION_BATCH_SIZE
+
+
+def to_bytes(array):
+    ''' Compact .npy encoding of a float32 array, for the BinaryField columns '''
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(array, dtype=np.float32), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def from_bytes(data):
+    return np.load(io.BytesIO(bytes(data)), allow_pickle=False)
+
+
+# explicit feedback alternating least squares over the observed ratings only
+class ALSModel:
+    def __init__(self, factors=32, regularization=0.1, iterations=10, seed=0):
+        self.factors = factors
+        self.regularization = regularization
+        self.iterations = iterations
+        self.seed = seed
+        self.global_mean = 0.0
+        self.user_factors = None
+        self.item_factors = None
+
+    def solve(self, matrix, fixed):
+        ''' Least squares factors for every row of the csr matrix with the other side held fixed '''
+        solved = np.zeros((matrix.shape[0], self.factors), dtype=np.float64)
+        identity = np.eye(self.factors)
+        for row in range(matrix.shape[0]):
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            if start == end:
+                continue
+            factors = fixed[matrix.indices[start:end]]
+            # weighted lambda regularization, scaled by the number of ratings in the row
+            gram = factors.T @ factors + self.regularization * (end - start) * identity
+            solved[row] = np.linalg.solve(gram, factors.T @ matrix.data[start:end])
+        return solved
+
+    def fit(self, ratings):
+        ''' Train on a sparse users x items csr matrix of ratings '''
+        ratings = ratings.tocsr().astype(np.float64)
+        self.global_mean = float(ratings.data.mean()) if ratings.nnz else 0.0
+        centered = ratings.copy()
+        centered.data -= self.global_mean
+        transposed = centered.T.tocsr()
+
+        random = np.random.RandomState(self.seed)
+        self.item_factors = random.normal(scale=0.1, size=(ratings.shape[1], self.factors))
+        for _ in range(self.iterations):
+            self.user_factors = self.solve(centered, self.item_factors)
+            self.item_factors = self.solve(transposed, self.user_factors)
+
+        self.user_factors = self.user_factors.astype(np.float32)
+        self.item_factors = self.item_factors.astype(np.float32)
+        return self
+
+
+def top_items(item_factors, user_vector, exclude=(), limit=10, global_mean=0.0):
+    ''' Indices and predicted ratings of the best scoring items, skipping the excluded indices '''
+    scores = item_factors @ user_vector
+    if len(exclude):
+        scores[np.asarray(exclude, dtype=np.int64)] = -np.inf
+    limit = min(limit, int(np.isfinite(scores).sum()))
+    if limit <= 0:
+        return []
+    best = np.argpartition(-scores, limit - 1)[:limit]
+    best = best[np.argsort(-scores[best])]
+    return [(int(index), float(scores[index] + global_mean)) for index in best]
+
+
+class RecommenderTrainer:
+    def __init__(self, factors=32, regularization=0.1, iterations=10):
+        self.model = ALSModel(factors, regularization, iterations)
+
+    def load_ratings(self):
+        ''' The ratings as a users x items csr matrix, with the user and track ids of its rows and columns '''
+        user_index, item_index = {}, {}
+        rows, columns, values = [], [], []
+        # ratings whose track was deleted have no column to land in
+        ratings = UserRatings.objects.filter(song_track__isnull=False).values_list("user_id", "song_track_id", "rating")
+        for user_id, track_id, rating in ratings.iterator():
+            rows.append(user_index.setdefault(user_id, len(user_index)))
+            columns.append(item_index.setdefault(track_id, len(item_index)))
+            values.append(float(rating))
+
+        matrix = sp.csr_matrix((values, (rows, columns)), shape=(len(user_index), len(item_index)), dtype=np.float64)
+        # a user rating the same track twice keeps their average rating
+        counts = sp.csr_matrix((np.ones(len(values)), (rows, columns)), shape=matrix.shape)
+        matrix.data /= counts.data
+        return list(user_index), list(item_index), matrix
+
+    def run(self, log=print):
+        user_ids, item_ids, ratings = self.load_ratings()
+        if not ratings.nnz:
+            return None
+        log("{} users, {} tracks, {} ratings".format(ratings.shape[0], ratings.shape[1], ratings.nnz))
+
+        started = time.monotonic()
+        self.model.fit(ratings)
+        training_ms = int((time.monotonic() - started) * 1000)
+        log("trained in {} ms".format(training_ms))
+
+        with transaction.atomic():
+            recommender = RecommenderModel.objects.create(factors=self.model.factors,
+                                                          global_mean=self.model.global_mean,
+                                                          item_ids=item_ids,
+                                                          item_factors=to_bytes(self.model.item_factors),
+                                                          training_ms=training_ms)
+            UserFactor.objects.bulk_create((UserFactor(model=recommender, user_id=user_id, vector=to_bytes(vector))
+                                            for user_id, vector in zip(user_ids, self.model.user_factors)),
+                                           batch_size=INGESTION_BATCH_SIZE)
+            RecommenderModel.objects.exclude(uid=recommender.uid).delete()
+        return recommender
+
+
+class Recommender:
+    ''' The latest trained model, with its item matrix loaded once per worker '''
+    _lock = threading.Lock()
+    _loaded = None
+
+    @classmethod
+    def current(cls):
+        latest = RecommenderModel.objects.order_by("-created_at").values_list("uid", flat=True).first()
+        if latest is None:
+            return None
+        loaded = cls._loaded
+        if loaded is None or loaded.uid != latest:
+            with cls._lock:
+                if cls._loaded is None or cls._loaded.uid != latest:
+                    cls._loaded = cls(RecommenderModel.objects.get(uid=latest))
+                loaded = cls._loaded
+        return loaded
+
+    def __init__(self, recommender):
+        self.uid = recommender.uid
+        self.global_mean = recommender.global_mean
+        self.item_ids = recommender.item_ids
+        self.item_index = {item_id: index for index, item_id in enumerate(self.item_ids)}
+        self.item_factors = from_bytes(recommender.item_factors)
+
+    def recommend(self, user, limit=10):
+        ''' Top (track id, predicted rating) pairs among the tracks the user has not rated yet '''
+        vector = UserFactor.objects.filter(model_id=self.uid, user=user).values_list("vector", flat=True).first()
+        if vector is None:
+            return []
+        rated = UserRatings.objects.filter(user=user).values_list("song_track_id", flat=True)
+        exclude = [self.item_index[track_id] for track_id in rated if track_id in self.item_index]
+        return [(self.item_ids[index], score)
+                for index, score in top_items(self.item_factors, from_bytes(vector), exclude, limit, self.global_mean)]
@@ -18,6 +18,8 @@ class PlayListSerializer(serializers.ModelSerializer):
     class Meta:
         model = PlayList
         fields = '__all__'
+        # playlists can be long, responses carry a bounded preview of the tracks instead of every id
+        extra_kwargs = {'tracks': {'write_only': True}}
 
 
 class UserRatingsSerializer(serializers.ModelSerializer):
@@ -1,159 +1,201 @@
-import requests, traceback
+import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, Max, Min, Sum
+from rest_framework.exceptions import ValidationError
+from base.utils import chunked, encode_cursor, decode_cursor
+from .cache import CatalogCache
+from .clients import spotify_client, token_provider
 from .exceptions import *
 from .models import *
+from .persistence import CatalogWriter
 from .serializers import *
 from .constants import *
-from django.db import transaction
-from MusicProj.settings import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_BASE_URL, SPOTIFY_AUTH_URL
+from MusicProj.settings import SPOTIFY_MAX_WORKERS, INGESTION_MODE, INGESTION_BATCH_SIZE
 
 
+# service class for calling Spotify api and locally storing the results in db
+class AlbumService:
+    @classmethod
+    def fetch_artist_batch(cls, batch, headers):
+        ''' Fetch up to ARTIST_BATCH_SIZE artists, the response cache keeps each artist as its own document
+            rather than the whole batch url, so a different mix of ids can still reuse them
+        '''
+        querystring = {"ids" : ",".join(batch)}
+        response = spotify_client.get('artists/', headers, querystring, cached=False)
+        # retries ran out, tracks saved without their artists and genres would go unnoticed
+        if response.status_code != 200:
+            raise ThirdPartyError(SONG_FETCH_ERROR)
+        artist_data = response.json().get("artists") or []
+        if spotify_client.cache is not None:
+            for details in artist_data:
+                if details:
+                    spotify_client.cache.set_document('artists', details.get("id"), details)
+        return artist_data
 
-def call_api(method, request_url, headers={}, querystring={}, data={}, timeout=180):
-    ''' Generic fucntion to call any API 
-        data format -> {
-                        'request_url': url_value,
-                        'headers': headers_dict,
-                        'params': params_dict
-                        }
-    '''
-    return requests.request(method, request_url, headers=headers, \
-                    params=querystring, data=data, timeout=timeout)
+
+    @classmethod
+    def fetch_album_tracks(cls, album_id, headers):
+        ''' Fetch every track of an album, following the `next` cursor of the tracks pages '''
+        querystring = {"limit": ALBUM_TRACKS_PAGE_LIMIT, "offset": 0}
+        request_url = 'albums/' + '{album_id}/tracks'.format(album_id=album_id)
+
+        items = []
+        for _, page in spotify_client.paginate(request_url, headers, querystring):
+            items.extend(page.get("items") or [])
+        return {"items": items}
 
 
-# service class for calling Spotify api and locally storing the results in db
-class AlbumService:
     @classmethod
-    def fetch_songs_from_api(cls, album_tracks_response, headers, track_ids, song_tracks, data):
-        try:
-            with transaction.atomic():
-                for track_data in album_tracks_response.get("items"):
-                    with transaction.atomic():
-                        genres_det = []
-                        artists_det = [value["name"] for value in track_data.get("artists")] if track_data.get("artists") else []
-                        artist_ids = [value["id"] for value in track_data.get("artists")]
-                        external_urls = track_data["external_urls"].get("spotify") if track_data.get('external_urls') else None
-
-                        track_ids.append(track_data.get("id"))
-
-                        querystring = {"ids" : artist_ids}
-                        request_url =  SPOTIFY_BASE_URL + 'artists/' 
-                        
-                        artist_data = call_api('GET', request_url, headers, querystring).json().get("artists")
-                        genres_det = list(set([",".join(data.get("genres")) for data in artist_data]))
-                        
-                        for details in artist_data:
-                            if not Artist.objects.filter(id=details.get("id")).exists():
-                                artist_url = details["external_urls"].get("spotify") if details.get('external_urls') else None
-                                artist_dict = {"name": details.get("name"),"popularity": details.get("popularity"),\
-                                            "external_urls":artist_url}            
-                                artist_serializer = ArtistSerializer(data=artist_dict)
-                                if artist_serializer.is_valid(raise_exception=True):
-                                    artist_serializer.save(id=details.get("id"))            
-
-                        track_dict = {"artists": artists_det, "name": track_data.get("name"), "external_urls":external_urls,
-                                    "duration_ms": track_data.get("duration_ms"), "genres": genres_det}
-                        try:
-                            tracks_serializer = SongTrackSerializer(data=track_dict)
-                            if tracks_serializer.is_valid(raise_exception=True):
-                                tracks_serializer.save(id=track_data.get("id"))
-                                song_tracks.append(tracks_serializer.data)
-                        except:
-                            pass          
-
-                    data["tracks"] = song_tracks
-        except:
-            raise SongFetchError(SONG_FETCH_ERROR)
-
-
-    @classmethod
-    def fetch_albums_from_api(cls, response, request_url, headers):
-        res_album_data = {}
-        try:
-            if response.status_code != 200:
-                raise ThirdPartyError(SONG_FETCH_ERROR)
+    def fetch_artists_from_api(cls, artist_ids, headers, artist_cache):
+        ''' Fetch the artist documents for a whole crawl in batches of ARTIST_BATCH_SIZE ids,
+            skipping the ids already held in the per-crawl artist_cache
+        '''
+        missing_ids = [artist_id for artist_id in dict.fromkeys(artist_ids) if artist_id not in artist_cache]
+
+        # artist documents still within their ttl in the on-disk response cache cost no request at all
+        if spotify_client.cache is not None:
+            for artist_id in list(missing_ids):
+                details = spotify_client.cache.get_document('artists', artist_id)
+                if details:
+                    artist_cache[artist_id] = details
+            missing_ids = [artist_id for artist_id in missing_ids if artist_id not in artist_cache]
+
+        with ThreadPoolExecutor(max_workers=SPOTIFY_MAX_WORKERS) as executor:
+            for artist_data in executor.map(partial(cls.fetch_artist_batch, headers=headers), \
+                                    chunked(missing_ids, ARTIST_BATCH_SIZE)):
+                for details in artist_data:
+                    if details:
+                        artist_cache[details.get("id")] = details
+
+        return artist_cache
+
+
+    @classmethod
+    def parse_artist(cls, details):
+        artist_url = details["external_urls"].get("spotify") if details.get('external_urls') else None
+        return {"id": details.get("id"), "name": details.get("name"), "popularity": details.get("popularity"),
+                    "external_urls": artist_url, "genres": details.get("genres") or []}
+
+
+    @classmethod
+    def parse_track(cls, track_data, artist_cache):
+        artists_det = [value["name"] for value in track_data.get("artists")] if track_data.get("artists") else []
+        artist_ids = [value["id"] for value in track_data.get("artists") or []]
+        external_urls = track_data["external_urls"].get("spotify") if track_data.get('external_urls') else None
+
+        artist_data = [artist_cache[artist_id] for artist_id in artist_ids if artist_id in artist_cache]
+        genres_det = sorted(set(genre for data in artist_data for genre in data.get("genres") or []))
+
+        return {"id": track_data.get("id"), "artists": artists_det, "name": track_data.get("name"),
+                    "external_urls": external_urls, "duration_ms": track_data.get("duration_ms") or 0, "genres": genres_det,
+                    "artist_ids": artist_ids}
+
+
+    @classmethod
+    def parse_album(cls, data):
+        album = {key: value for key, value in data.items() if key in ALBUM_FIELDS}
+        album["artists"] = [value["name"] for value in data.get('artists')] if data.get('artists') else []
+        album["external_urls"] = data["external_urls"].get("spotify") if data.get('external_urls') else None
+        return album
+
+
+    @classmethod
+    def fetch_new_releases(cls, limit, offset, headers=None):
+        headers = headers or token_provider.get_headers()
+        querystring = {"limit":limit, "offset":offset}
 
-            page = response.json()
+        response = spotify_client.get('browse/new-releases/', headers, querystring)
+        if response.status_code != 200:
+            raise ThirdPartyError(SONG_FETCH_ERROR)
+        return response.json()
+
+
+    @classmethod
+    def fetch_albums_from_api(cls, page, headers):
+        try:
             album_data = page.get("albums").get("items")
 
-            page_data = {field: page.get("albums").get(field) for field in PAGE_FIELDS}
+            # the network calls of a page run concurrently, the db writes below stay sequential and ordered
+            album_ids = [data.get("id") for data in album_data]
+            with ThreadPoolExecutor(max_workers=SPOTIFY_MAX_WORKERS) as executor:
+                album_tracks = dict(zip(album_ids, executor.map(partial(cls.fetch_album_tracks, headers=headers), album_ids)))
+
+            # collect the artists of the whole page so that each one is fetched only once per crawl
+            page_artist_ids = [artist["id"] for tracks_response in album_tracks.values()
+                                for track_data in tracks_response.get("items") or []
+                                for artist in track_data.get("artists") or []]
+            artist_cache = cls.fetch_artists_from_api(page_artist_ids, headers, {})
 
+            albums = []
             for data in album_data:
-                id = data.pop("id")
-                track_ids, song_tracks = [], []
-
-                querystring = {"limit": 30, "offset": 0}
-
-                request_url =  SPOTIFY_BASE_URL + 'albums/' + '{album_id}/tracks'.format(album_id=id)
-
-                album_tracks_response = call_api('GET', request_url, headers, querystring).json()
- 
-                dict_keys = list(data.keys())
-                remove_fields = list(set(dict_keys) - set(ALBUM_FIELDS))
-
-                for key in remove_fields:
-                    data.pop(key)
-                
-                data["artists"] = [value["name"] for value in data.get('artists')] if data.get('artists') else []
-                data["external_urls"] = data["external_urls"].get("spotify") if data.get('external_urls') else None
-
-                res_album_data.update(data)
-                try:
-                    with transaction.atomic():
-                        cls.fetch_songs_from_api(album_tracks_response, headers, track_ids, song_tracks, data)
-
-                        album_id = {"id" : id}
-                        instance = Album(**album_id)
-
-                        album_serializer = AlbumSerializer(instance, data=res_album_data)
-                        if album_serializer.is_valid(raise_exception=True):
-                            album_obj = album_serializer.save()
-                            album_obj.tracks.add(*track_ids)                            
-                except:
-                    raise ThirdPartyError(API_ERROR)
-                
-            album_data.update(page_data=page_data)
-            return album_data
-
-        except (ThirdPartyError, SongFetchError) as e:
+                album = cls.parse_album(data)
+                album["tracks"] = [cls.parse_track(track_data, artist_cache)
+                                    for track_data in album_tracks[album["id"]].get("items") or []]
+                albums.append(album)
+
+            artists = [cls.parse_artist(artist_cache[artist_id]) for artist_id in dict.fromkeys(page_artist_ids)
+                            if artist_id in artist_cache]
+            try:
+                CatalogWriter.save_page(albums, artists)
+            except DatabaseError:
+                raise ThirdPartyError(API_ERROR)
+
+            return albums
+
+        except ThirdPartyError as e:
             raise APIException(str(e))
 
 
     @classmethod
-    def get_songs_list(cls, limit, offset):
-        try:
-            import requests
-            if not Album.objects.all()[offset:offset+limit].exists():
-                auth_response = call_api('POST', SPOTIFY_AUTH_URL, data={
-                            'grant_type': 'client_credentials',
-                            'client_id': SPOTIFY_CLIENT_ID,
-                            'client_secret': SPOTIFY_CLIENT_SECRET,
-                        })
+    def attach_tracks(cls, album_results):
+        ''' Attach the tracks of a page of album rows, loaded for the whole page with one query '''
+        album_tracks = {album["id"]: [] for album in album_results}
+        track_rows = Album.tracks.through.objects.filter(album_id__in=list(album_tracks)).order_by("id") \
+                        .values("album_id", *["songtrack__" + field for field in TRACK_FIELDS])
 
-                # convert the response to JSON
-                auth_response_data = auth_response.json()
+        for row in track_rows:
+            album_tracks[row["album_id"]].append({field: row["songtrack__" + field] for field in TRACK_FIELDS})
 
-                # save the access token
-                access_token = auth_response_data['access_token']
+        for album in album_results:
+            album["tracks"] = album_tracks[album["id"]]
+        return album_results
 
-                headers = {
-                    'Authorization': 'Bearer {token}'.format(token=access_token)
-                }
 
-                querystring = {"limit":limit, "offset":offset}
+    @classmethod
+    def get_songs_page(cls, limit, cursor):
+        ''' Keyset paginated albums ordered by their primary key, no count or offset scan is needed '''
+        after = decode_cursor(cursor) if cursor else ""
+        if not isinstance(after, str):
+            raise ValidationError("Invalid cursor")
+        queryset = Album.objects.order_by("id")
+        if after:
+            queryset = queryset.filter(id__gt=after)
 
-                request_url =  SPOTIFY_BASE_URL + 'browse/new-releases/'
+        album_rows = list(queryset.values(*ALBUM_FIELDS)[:limit + 1])
+        next_cursor = encode_cursor(album_rows[limit - 1]["id"]) if len(album_rows) > limit else None
+        return {"results": cls.attach_tracks(album_rows[:limit]), "next_cursor": next_cursor}
 
-                api_response = call_api('GET', request_url, headers, querystring)
 
-                album_results = cls.fetch_albums_from_api(api_response, request_url, headers)
+    @classmethod
+    def get_songs_list(cls, limit, offset):
+        try:
+            if not Album.objects.all()[offset:offset+limit].exists():
+                if INGESTION_MODE == "queue":
+                    # the ingestion workers fill the page in, the api only serves what is already stored
+                    from .jobs import IngestionQueue
+                    IngestionQueue.enqueue(IngestionJob.NEW_RELEASES, {"limit": limit, "offset": offset}, unique=True)
+                    return []
+
+                headers = token_provider.get_headers()
+
+                page = cls.fetch_new_releases(limit, offset, headers)
+
+                album_results = cls.fetch_albums_from_api(page, headers)
 
             else:
-                album_queryset = Album.objects.all()[offset:offset+limit] 
-                album_results = AlbumSerializer(album_queryset, many=True).data  
-                for data in album_results:
-                    album_obj = Album.objects.filter(id=data.get("id")).first()
-                    music_tracks = list(album_obj.tracks.values())
-                    data.update({"tracks": music_tracks}) 
+                album_results = cls.attach_tracks(list(Album.objects.all()[offset:offset+limit].values(*ALBUM_FIELDS)))
 
             return album_results
         
@@ -161,4 +203,265 @@ class AlbumService:
             raise APIException(str(e))   
     
 
-    
\ No newline at end of file
+    
+
+
+# service class sampling the maintained catalog facets for auto generated playlists
+class FacetService:
+    @classmethod
+    def wrapped_sample(cls, queryset, field, pivot, limit):
+        ''' Up to limit rows ordered by field from the random pivot onwards, wrapping around to the start '''
+        rows = list(queryset.filter(**{field + "__gte": pivot}).order_by(field)[:limit])
+        if len(rows) < limit:
+            rows += list(queryset.filter(**{field + "__lt": pivot}).order_by(field)[:limit - len(rows)])
+        return rows
+
+
+    @classmethod
+    def random_facet(cls, kind=None):
+        ''' A random facet of the kind (by default a random kind among those having facets) and its display name,
+            or None for an empty catalog
+        '''
+        if kind is None:
+            kinds = [choice for choice, _ in CatalogFacet.KINDS if CatalogFacet.objects.filter(kind=choice).exists()]
+            if not kinds:
+                return None, None
+            kind = random.choice(kinds)
+        facet = cls.wrapped_sample(CatalogFacet.objects.filter(kind=kind), "sort_key", random.random(), 1)
+        if not facet:
+            return None, None
+        name = CatalogFacet.owner_model(kind).objects.filter(pk=facet[0].object_id).values_list("name", flat=True).first()
+        return facet[0], name
+
+
+    @classmethod
+    def sample_tracks(cls, facet, limit=AUTO_PLAYLIST_SIZE):
+        ''' Up to limit tracks of the facet, read from a random pivot between its first and last link ids '''
+        through, column = CatalogFacet.links(facet.kind)
+        links = through.objects.filter(**{column: facet.object_id})
+        bounds = links.aggregate(low=Min("id"), high=Max("id"))
+        if bounds["low"] is None:
+            return []
+        pivot = random.randint(bounds["low"], bounds["high"])
+        track_ids = [track_id for track_id, _ in cls.wrapped_sample(links.values_list("songtrack_id", "id"), "id", pivot, limit)]
+        rows = {row["id"]: row for row in SongTrack.objects.filter(id__in=track_ids).values(*TRACK_FIELDS)}
+        return [rows[track_id] for track_id in track_ids if track_id in rows]
+
+
+# collects every track and album of a response once, for the compact side loaded response format
+class SideLoadedPayload:
+    def __init__(self):
+        self.tracks = {}
+        self.albums = {}
+
+    def add_tracks(self, rows):
+        ''' Keep each track row once, folding its album__id and album__name into the albums, and return the track ids
+            in the order of the rows
+        '''
+        track_ids = []
+        for row in rows:
+            row = dict(row)
+            album_id, album_name = row.pop("album__id", None), row.pop("album__name", None)
+            track = self.tracks.setdefault(row["id"], {**row, "albums": []})
+            if album_id is not None and album_id not in track["albums"]:
+                track["albums"].append(album_id)
+                self.albums.setdefault(album_id, {"id": album_id, "name": album_name})
+            track_ids.append(row["id"])
+        return list(dict.fromkeys(track_ids))
+
+    def included(self):
+        return {"tracks": self.tracks, "albums": self.albums}
+
+
+# service class applying track changes to playlists as diffs on the playlist tracks through table
+class PlaylistService:
+    @classmethod
+    def validate_tracks(cls, track_ids):
+        ''' The unique track ids, raising PlaylistException if any of them is not a stored song track '''
+        track_ids = list(dict.fromkeys(track_ids))
+        if SongTrack.objects.filter(id__in=track_ids).count() != len(track_ids):
+            raise PlaylistException(INVALID_TRACK_IDS_ERR)
+        return track_ids
+
+
+    @classmethod
+    def fetch_tracks(cls, links, params):
+        ''' (playlist id, through row id, track) for the through rows selected by the `links` subquery, in the order
+            they were added, each track with the id and name of its album
+        '''
+        sql = """SELECT link.playlist_id, link.id, {track_columns}, first_album.id, first_album.name
+            FROM ({links}) AS link
+            JOIN {tracks} AS track ON track.id = link.songtrack_id
+            LEFT JOIN LATERAL (SELECT album.id, album.name FROM {album_tracks} AS album_track
+                JOIN {albums} AS album ON album.id = album_track.album_id
+                WHERE album_track.songtrack_id = track.id ORDER BY album_track.id LIMIT 1) AS first_album ON true
+            ORDER BY link.playlist_id, link.id""".format(
+                links=links.format(playlist_tracks=PlayList.tracks.through._meta.db_table),
+                track_columns=", ".join("track." + field for field in TRACK_FIELDS),
+                album_tracks=Album.tracks.through._meta.db_table, albums=Album._meta.db_table, tracks=SongTrack._meta.db_table)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(row[0], row[1], dict(zip(TRACK_FIELDS + ["album__id", "album__name"], row[2:])))
+                        for row in cursor.fetchall()]
+
+
+    @classmethod
+    def embed_tracks(cls, tracks, payload=None):
+        ''' Full track dicts with their album name, or just their ids when side loading them into a compact payload '''
+        if payload is not None:
+            return payload.add_tracks(tracks)
+        for track in tracks:
+            track.pop("album__id", None)
+        return tracks
+
+
+    @classmethod
+    def track_previews(cls, track_counts, limit=PLAYLIST_TRACKS_PREVIEW, payload=None):
+        ''' The first tracks of each playlist, given as {playlist id: stored track_count}, with the cursor of the
+            remaining tracks, from a single windowed query
+        '''
+        pages = {playlist_id: ([], None) for playlist_id in track_counts}
+        if pages:
+            links = """SELECT id, playlist_id, songtrack_id FROM (SELECT id, playlist_id, songtrack_id,
+                    row_number() OVER (PARTITION BY playlist_id ORDER BY id) AS position
+                  FROM {playlist_tracks} WHERE playlist_id = ANY(%s::uuid[])) AS numbered WHERE position <= %s"""
+            for playlist_id, link_id, track in cls.fetch_tracks(links, [[str(playlist_id) for playlist_id in pages], limit]):
+                pages[playlist_id][0].append(track)
+                pages[playlist_id] = (pages[playlist_id][0], link_id)
+
+        previews = {}
+        for playlist_id, (tracks, last_id) in pages.items():
+            track_count = track_counts[playlist_id]
+            previews[playlist_id] = {"tracks": cls.embed_tracks(tracks, payload), "track_count": track_count,
+                                     "tracks_cursor": encode_cursor(last_id) if track_count > len(tracks) else None}
+        return previews
+
+
+    @classmethod
+    def get_tracks_page(cls, playlist, limit, cursor, payload=None):
+        ''' Keyset paginated tracks of a playlist, ordered by when they were added '''
+        after = decode_cursor(cursor) if cursor else 0
+        if not isinstance(after, int):
+            raise ValidationError("Invalid cursor")
+        # one row past the page tells whether another page follows
+        links = """SELECT id, playlist_id, songtrack_id FROM {playlist_tracks}
+            WHERE playlist_id = %s::uuid AND id > %s ORDER BY id LIMIT %s"""
+        rows = cls.fetch_tracks(links, [str(playlist.pk), after, limit + 1])
+        page = rows[:limit]
+        return {"results": cls.embed_tracks([track for _, _, track in page], payload),
+                "next_cursor": encode_cursor(page[-1][1]) if len(rows) > limit else None}
+
+
+    @classmethod
+    def lock(cls, playlist):
+        ''' Row lock the playlist until the end of the transaction, so concurrent changes to it apply one after the other '''
+        PlayList.objects.select_for_update().filter(pk=playlist.pk).values_list("pk", flat=True).get()
+
+
+    @classmethod
+    def add_tracks(cls, playlist, track_ids):
+        ''' Link the tracks not already in the playlist and return their ids '''
+        through = PlayList.tracks.through
+        with transaction.atomic():
+            cls.lock(playlist)
+            existing = set(through.objects.filter(playlist_id=playlist.pk, songtrack_id__in=track_ids)
+                            .values_list("songtrack_id", flat=True))
+            added = [track_id for track_id in dict.fromkeys(track_ids) if track_id not in existing]
+            through.objects.bulk_create([through(playlist_id=playlist.pk, songtrack_id=track_id) for track_id in added],
+                                        batch_size=INGESTION_BATCH_SIZE)
+            cls.tracks_changed(playlist, added)
+        return added
+
+
+    @classmethod
+    def remove_tracks(cls, playlist, track_ids):
+        ''' Unlink the given tracks that are in the playlist and return their ids '''
+        with transaction.atomic():
+            cls.lock(playlist)
+            links = PlayList.tracks.through.objects.filter(playlist_id=playlist.pk, songtrack_id__in=list(track_ids))
+            removed = list(links.values_list("songtrack_id", flat=True))
+            links.delete()
+            cls.tracks_changed(playlist, removed)
+        return removed
+
+
+    @classmethod
+    def set_tracks(cls, playlist, track_ids):
+        ''' Make the playlist hold exactly the given tracks, touching only the through rows that change '''
+        with transaction.atomic():
+            cls.lock(playlist)
+            current = set(PlayList.tracks.through.objects.filter(playlist_id=playlist.pk).values_list("songtrack_id", flat=True))
+            wanted = set(track_ids)
+            removed = cls.remove_tracks(playlist, current - wanted) if current - wanted else []
+            added = cls.add_tracks(playlist, [track_id for track_id in track_ids if track_id not in current])
+        return added, removed
+
+
+    @classmethod
+    def reweigh(cls, track_ids):
+        ''' Tracks are ranked by playlist membership in the in-memory indexes, have them reload these once committed '''
+        if track_ids:
+            transaction.on_commit(partial(CatalogCache.bump_weights, list(track_ids)))
+
+
+    @classmethod
+    def top_genres(cls, genre_counts):
+        return [genre for genre, _ in sorted(genre_counts.items(), key=lambda item: (-item[1], item[0]))[:PLAYLIST_TOP_GENRES]]
+
+
+    @classmethod
+    def tracks_changed(cls, playlist, track_ids):
+        ''' Bring the stored aggregates of the playlist and the typeahead weights of the tracks up to date '''
+        if not track_ids:
+            return
+        stats = cls.refresh_stats([playlist.pk]).get(playlist.pk)
+        if stats is not None:
+            for field in PLAYLIST_STATS_FIELDS:
+                setattr(playlist, field, getattr(stats, field))
+        cls.reweigh(track_ids)
+
+
+    @classmethod
+    def refresh_stats(cls, playlist_ids):
+        ''' Recompute the stored aggregates of the playlists from the tracks they hold now, returns them by playlist id.
+            Never derived from the previous aggregates, re-ingested track durations and genres can't make them drift
+        '''
+        genres_sql = """SELECT link.playlist_id, track_genre.genre, count(*) FROM {playlist_tracks} AS link
+            JOIN {tracks} AS track ON track.id = link.songtrack_id
+            CROSS JOIN LATERAL (SELECT DISTINCT unnest(track.genres) AS genre) AS track_genre
+            WHERE link.playlist_id = ANY(%s::uuid[])
+            GROUP BY link.playlist_id, track_genre.genre""".format(
+                playlist_tracks=PlayList.tracks.through._meta.db_table, tracks=SongTrack._meta.db_table)
+
+        with transaction.atomic():
+            # row locks in a fixed order, concurrent refreshes of a playlist count one after the other
+            locked = PlayList.objects.select_for_update().filter(uid__in=list(playlist_ids)).order_by("uid")
+            playlists = {playlist_id: PlayList(uid=playlist_id, track_count=0, total_duration_ms=0, genre_counts={})
+                            for playlist_id in locked.values_list("uid", flat=True)}
+            if not playlists:
+                return playlists
+
+            totals = PlayList.tracks.through.objects.filter(playlist_id__in=list(playlists)).values("playlist_id") \
+                        .annotate(tracks=Count("id"), duration=Sum("songtrack__duration_ms")).order_by()
+            for row in totals:
+                playlist = playlists[row["playlist_id"]]
+                playlist.track_count, playlist.total_duration_ms = row["tracks"], row["duration"] or 0
+            with connection.cursor() as cursor:
+                cursor.execute(genres_sql, [[str(playlist_id) for playlist_id in playlists]])
+                for playlist_id, genre, count in cursor.fetchall():
+                    playlists[playlist_id].genre_counts[genre] = count
+
+            for playlist in playlists.values():
+                playlist.top_genres = cls.top_genres(playlist.genre_counts)
+            PlayList.objects.bulk_update(playlists.values(), PLAYLIST_STATS_FIELDS)
+        return playlists
+
+
+    @classmethod
+    def rebuild_stats(cls, batch_size=INGESTION_BATCH_SIZE):
+        ''' Recompute the aggregates of every playlist from its tracks, returns the number of playlists '''
+        rebuilt = 0
+        for batch in chunked(list(PlayList.objects.values_list("uid", flat=True)), batch_size):
+            rebuilt += len(cls.refresh_stats(batch))
+        return rebuilt
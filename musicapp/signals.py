@@ -0,0 +1,38 @@
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+from .models import PlayList, SongTrack
+from .services import PlaylistService
+
+
+# playlist tracks written around PlaylistService, by the serializers' m2m set(), the admin or cascade deletes,
+# still keep the stored playlist stats and the typeahead weights up to date
+@receiver(m2m_changed, sender=PlayList.tracks.through)
+def playlist_tracks_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    column = "songtrack_id" if reverse else "playlist_id"
+    if action == "pre_clear":
+        # the cleared links are gone by post_clear
+        instance._cleared_links = list(sender.objects.filter(**{column: instance.pk}).values_list("playlist_id", "songtrack_id"))
+        return
+    if action == "post_clear":
+        links = instance.__dict__.pop("_cleared_links", [])
+    elif action in ("post_add", "post_remove"):
+        links = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set or ()]
+    else:
+        return
+
+    if links:
+        PlaylistService.refresh_stats({playlist_id for playlist_id, _ in links})
+        PlaylistService.reweigh({track_id for _, track_id in links})
+
+
+@receiver(pre_delete, sender=SongTrack)
+def remember_track_playlists(sender, instance, **kwargs):
+    instance._playlist_ids = list(PlayList.tracks.through.objects.filter(songtrack_id=instance.pk)
+                                    .values_list("playlist_id", flat=True))
+
+
+@receiver(post_delete, sender=SongTrack)
+def refresh_track_playlists(sender, instance, **kwargs):
+    playlist_ids = instance.__dict__.pop("_playlist_ids", [])
+    if playlist_ids:
+        PlaylistService.refresh_stats(playlist_ids)
@@ -0,0 +1,67 @@
+import numpy as np
+from django.db import transaction
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sparse_dot_topn import awesome_cossim_topn
+from .models import *
+from MusicProj.settings import INGESTION_BATCH_SIZE
+
+
+# offline content based similarity between tracks, tf-idf over genres, artists and album
+class SimilarTracksBuilder:
+    def __init__(self, top_k=10, block_size=2000, min_score=0.05):
+        self.top_k = top_k
+        self.block_size = block_size
+        self.min_score = min_score
+
+    def load_documents(self):
+        ''' One bag of prefixed feature tokens per track, e.g. ["g:indie", "a:<artist id>", "al:<album id>"] '''
+        documents = {}
+        links = (
+            ("g:", SongTrack.track_genres.through.objects.values_list("songtrack_id", "genre__name")),
+            ("a:", SongTrack.track_artists.through.objects.values_list("songtrack_id", "artist_id")),
+            ("al:", Album.tracks.through.objects.values_list("songtrack_id", "album_id")),
+        )
+        for prefix, rows in links:
+            for track_id, feature in rows.iterator():
+                documents.setdefault(track_id, []).append(prefix + str(feature))
+
+        track_ids = sorted(documents)
+        return track_ids, [documents[track_id] for track_id in track_ids]
+
+    def build_matrix(self, documents):
+        ''' L2 normalised sparse tf-idf rows, so a dot product between two rows is their cosine similarity '''
+        vectorizer = TfidfVectorizer(analyzer=lambda tokens: tokens, sublinear_tf=True, dtype=np.float64)
+        return vectorizer.fit_transform(documents).tocsr()
+
+    def neighbours(self, matrix):
+        ''' Yield (row, [(column, score)...]) with the top_k most similar other rows, one block of rows at a time '''
+        transposed = matrix.T.tocsr()
+        for start in range(0, matrix.shape[0], self.block_size):
+            block = awesome_cossim_topn(matrix[start:start + self.block_size], transposed, self.top_k + 1, self.min_score)
+            for offset in range(block.shape[0]):
+                row = block.getrow(offset)
+                pairs = sorted(zip(row.indices, row.data), key=lambda pair: -pair[1])
+                yield start + offset, [(column, float(score)) for column, score in pairs if column != start + offset][:self.top_k]
+
+    def run(self, log=print):
+        track_ids, documents = self.load_documents()
+        if not track_ids:
+            return 0
+
+        matrix = self.build_matrix(documents)
+        log("{} tracks, {} features".format(*matrix.shape))
+
+        written = 0
+        with transaction.atomic():
+            SimilarTrack.objects.all().delete()
+            rows = []
+            for row, pairs in self.neighbours(matrix):
+                rows.extend(SimilarTrack(track_id=track_ids[row], similar_id=track_ids[column], rank=rank, score=score)
+                                for rank, (column, score) in enumerate(pairs))
+                if len(rows) >= INGESTION_BATCH_SIZE:
+                    SimilarTrack.objects.bulk_create(rows, batch_size=INGESTION_BATCH_SIZE)
+                    written += len(rows)
+                    rows = []
+            SimilarTrack.objects.bulk_create(rows, batch_size=INGESTION_BATCH_SIZE)
+            written += len(rows)
+        return written
@@ -1,3 +1,723 @@
-from django.test import TestCase
+import os, random, tempfile, threading, time
+import scipy.sparse as sp
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, TransactionTestCase, override_settings
 
 # Create your tests here.
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from authentication.models import User
+from base.utils import encode_cursor
+from .cache import CatalogCache
+from .clients import SpotifyClient, spotify_client, token_provider
+from .constants import PLAYLIST_TRACKS_PREVIEW, SPELLING_MAX_DISTANCE
+from .exceptions import ThirdPartyError
+from .fake_spotify import FakeCatalog, FakeSpotifyServer
+from .http_cache import ResponseCache
+from .jobs import IngestionQueue
+from .recommender import ALSModel, Recommender, RecommenderTrainer, top_items
+from .indexes import BKTree, PrefixIndex, SpellingIndex, SuggestionIndex, levenshtein
+from .models import (Album, Artist, CatalogFacet, Genre, IngestionJob, PlayList, RecommenderModel, SimilarTrack,
+                     SongTrack, UserFactor, UserRatings)
+from .persistence import CatalogWriter
+from .services import AlbumService, FacetService, PlaylistService
+
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "musicapp-tests"}}
+
+
+def authenticated_client():
+    user = User.objects.create_user("listener@example.com", "password", user_name="listener",
+                                    first_name="Test", last_name="Listener")
+    client = APIClient()
+    client.force_authenticate(user)
+    return user, client
+
+
+class PlaylistListTest(TestCase):
+
+    def setUp(self):
+        self.user, self.client = authenticated_client()
+
+    def create_playlists(self, count, start=0, tracks_per_playlist=3):
+        for number in range(start, start + count):
+            album = Album.objects.create(id="album{}".format(number), name="Album {}".format(number))
+            tracks = [SongTrack.objects.create(id="track{}-{}".format(number, index), name="Track {}".format(index))
+                        for index in range(tracks_per_playlist)]
+            album.tracks.add(*tracks)
+            playlist = PlayList.objects.create(user=self.user, playlist_name="Playlist {}".format(number))
+            PlaylistService.add_tracks(playlist, [track.id for track in tracks])
+
+    def test_tracks_with_album_names(self):
+        self.create_playlists(2)
+        response = self.client.get(reverse("playlist-list"))
+
+        self.assertEqual(response.status_code, 200)
+        playlists = {playlist["playlist_name"]: playlist for playlist in response.json()["results"]}
+        self.assertEqual(len(playlists), 2)
+        tracks = playlists["Playlist 1"]["tracks"]
+        self.assertEqual(sorted(track["id"] for track in tracks), ["track1-0", "track1-1", "track1-2"])
+        self.assertTrue(all(track["album__name"] == "Album 1" for track in tracks))
+
+    def test_tracks_preview_and_cursor(self):
+        self.create_playlists(1, tracks_per_playlist=25)
+        playlist = self.client.get(reverse("playlist-list")).json()["results"][0]
+        self.assertEqual(len(playlist["tracks"]), PLAYLIST_TRACKS_PREVIEW)
+        self.assertEqual(playlist["track_count"], 25)
+
+        page = self.client.get(reverse("playlist-tracks", args=[playlist["uid"]]),
+                               {"cursor": playlist["tracks_cursor"], "limit": 10}).json()
+        self.assertEqual(len(page["results"]), 5)
+        self.assertIsNone(page["next_cursor"])
+
+        # a page ending exactly on the last track has no next page
+        first = self.client.get(reverse("playlist-tracks", args=[playlist["uid"]]), {"limit": 20}).json()
+        last = self.client.get(reverse("playlist-tracks", args=[playlist["uid"]]),
+                               {"cursor": first["next_cursor"], "limit": 5}).json()
+        self.assertEqual(len(last["results"]), 5)
+        self.assertIsNone(last["next_cursor"])
+        self.assertEqual({track["id"] for track in playlist["tracks"] + page["results"]},
+                         {"track0-{}".format(index) for index in range(25)})
+
+    def test_retrieve_returns_a_preview(self):
+        self.create_playlists(1, tracks_per_playlist=25)
+        playlist = PlayList.objects.get(user=self.user)
+
+        data = self.client.get(reverse("playlist-detail", args=[playlist.pk])).json()["data"]
+        self.assertEqual(len(data["tracks"]), PLAYLIST_TRACKS_PREVIEW)
+        self.assertEqual(data["track_count"], 25)
+        self.assertIsNotNone(data["tracks_cursor"])
+
+    def test_compact_listing_side_loads_tracks(self):
+        self.create_playlists(2)
+        playlist = PlayList.objects.get(playlist_name="Playlist 1")
+        PlaylistService.add_tracks(playlist, ["track0-0"])
+
+        data = self.client.get(reverse("playlist-list"), {"compact": "true"}).json()
+        playlists = {playlist["playlist_name"]: playlist for playlist in data["results"]}
+        self.assertEqual(playlists["Playlist 1"]["tracks"], ["track1-0", "track1-1", "track1-2", "track0-0"])
+        self.assertEqual(len(data["included"]["tracks"]), 6)
+        self.assertEqual(data["included"]["tracks"]["track0-0"]["albums"], ["album0"])
+        self.assertEqual(data["included"]["albums"]["album1"], {"id": "album1", "name": "Album 1"})
+
+    def test_query_count_does_not_grow_with_playlists(self):
+        self.create_playlists(1)
+        with self.assertNumQueries(3):
+            self.client.get(reverse("playlist-list"))
+
+        self.create_playlists(9, start=1)
+        # paginator count, page of playlists, track previews of the page
+        with self.assertNumQueries(3):
+            self.client.get(reverse("playlist-list"))
+
+    def test_add_and_remove_tracks(self):
+        self.create_playlists(1)
+        playlist = PlayList.objects.get(user=self.user)
+        SongTrack.objects.create(id="extra", name="Extra")
+
+        response = self.client.post(reverse("playlist-add-tracks", args=[playlist.pk]), {"tracks": ["extra", "track0-0"]},
+                                    format="json")
+        self.assertEqual(response.json()["data"], {"added": ["extra"]})
+
+        response = self.client.post(reverse("playlist-remove-tracks", args=[playlist.pk]), {"tracks": ["track0-1", "missing"]},
+                                    format="json")
+        self.assertEqual(response.json()["data"], {"removed": ["track0-1"]})
+        self.assertEqual(set(playlist.tracks.values_list("id", flat=True)), {"track0-0", "track0-2", "extra"})
+
+    def test_create_validates_tracks(self):
+        SongTrack.objects.create(id="first", name="First")
+        SongTrack.objects.create(id="second", name="Second")
+
+        response = self.client.post(reverse("playlist-list"), {"playlist_name": "Broken", "tracks": ["first", "missing"]},
+                                    format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PlayList.objects.filter(playlist_name="Broken").exists())
+
+        response = self.client.post(reverse("playlist-list"), {"playlist_name": "Mix", "tracks": ["second", "first", "second"]},
+                                    format="json")
+        self.assertEqual([track["id"] for track in response.json()["data"]["tracks"]], ["second", "first"])
+
+    def test_stats_follow_track_changes(self):
+        playlist = PlayList.objects.create(user=self.user, playlist_name="Stats")
+        SongTrack.objects.create(id="rock", duration_ms=1000, genres=["rock"])
+        SongTrack.objects.create(id="indie-rock", duration_ms=2000, genres=["indie", "rock"])
+
+        PlaylistService.add_tracks(playlist, ["rock", "indie-rock"])
+        playlist.refresh_from_db()
+        self.assertEqual((playlist.track_count, playlist.total_duration_ms), (2, 3000))
+        self.assertEqual(playlist.genre_counts, {"rock": 2, "indie": 1})
+        self.assertEqual(playlist.top_genres, ["rock", "indie"])
+
+        PlaylistService.set_tracks(playlist, ["indie-rock"])
+        playlist.refresh_from_db()
+        self.assertEqual((playlist.track_count, playlist.total_duration_ms), (1, 2000))
+        self.assertEqual(playlist.genre_counts, {"rock": 1, "indie": 1})
+
+    def test_stats_survive_reingested_tracks(self):
+        playlist = PlayList.objects.create(user=self.user, playlist_name="Stats")
+        SongTrack.objects.create(id="song", duration_ms=1000, genres=["rock"])
+        PlaylistService.add_tracks(playlist, ["song"])
+
+        # re-ingestion rewrote the track before it was removed
+        SongTrack.objects.filter(id="song").update(duration_ms=5000, genres=["jazz"])
+        PlaylistService.remove_tracks(playlist, ["song"])
+        playlist.refresh_from_db()
+        self.assertEqual((playlist.track_count, playlist.total_duration_ms, playlist.genre_counts), (0, 0, {}))
+
+    def test_stats_follow_changes_around_the_service(self):
+        playlist = PlayList.objects.create(user=self.user, playlist_name="Stats")
+        first = SongTrack.objects.create(id="first", duration_ms=1000, genres=["rock"])
+        SongTrack.objects.create(id="second", duration_ms=2000, genres=["pop"])
+
+        response = self.client.patch(reverse("playlist-detail", args=[playlist.pk]), {"tracks": ["first", "second"]},
+                                     format="json")
+        self.assertEqual(response.status_code, 200)
+        playlist.refresh_from_db()
+        self.assertEqual((playlist.track_count, playlist.total_duration_ms), (2, 3000))
+
+        first.delete()
+        playlist.refresh_from_db()
+        self.assertEqual((playlist.track_count, playlist.total_duration_ms, playlist.genre_counts), (1, 2000, {"pop": 1}))
+
+        playlist.tracks.clear()
+        playlist.refresh_from_db()
+        self.assertEqual((playlist.track_count, playlist.top_genres), (0, []))
+
+
+# transactional so the catalog version bumps registered with on_commit actually run
+@override_settings(CACHES=LOCMEM_CACHES)
+class FetchTracksPageCacheTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user, self.client = authenticated_client()
+        CatalogWriter.save_albums([self.album("a"), self.album("b")])
+
+    def album(self, album_id, name=None):
+        return {"id": album_id, "album_type": "album", "name": name or "Album " + album_id, "release_date": "2020-01-01",
+                "artists": [], "total_tracks": 0, "external_urls": ""}
+
+    def page(self, cursor):
+        return self.client.get(reverse("fetch-tracks-list"), {"cursor": cursor, "limit": 1}).json()
+
+    def test_album_write_invalidates_only_its_pages(self):
+        self.assertEqual(self.page("")["results"][0]["name"], "Album a")
+        second = self.page(encode_cursor("a"))
+
+        CatalogWriter.save_albums([self.album("a", "Renamed")])
+
+        # the page without album a is still served from the cache
+        with self.assertNumQueries(0):
+            self.assertEqual(self.page(encode_cursor("a")), second)
+        self.assertEqual(self.page("")["results"][0]["name"], "Renamed")
+
+    def test_new_album_invalidates_every_page(self):
+        self.assertEqual(self.page(encode_cursor("a"))["results"][0]["id"], "b")
+
+        CatalogWriter.save_albums([self.album("aa")])
+
+        self.assertEqual(self.page(encode_cursor("a"))["results"][0]["id"], "aa")
+
+    def test_concurrent_bumps_get_distinct_versions(self):
+        def bump(number):
+            try:
+                return CatalogCache.bump_version({"tracks": [number]})
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(4) as pool:
+            versions = list(pool.map(bump, range(20)))
+        self.assertEqual(len(set(versions)), 20)
+        self.assertEqual(CatalogCache.get_changes(min(versions) - 1, max(versions))["tracks"], set(range(20)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SpotifyIngestionTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # the on-disk response cache would answer repeated runs without reaching the fake server
+        saved_cache, spotify_client.cache = spotify_client.cache, None
+        self.addCleanup(setattr, spotify_client, "cache", saved_cache)
+        token_provider.invalidate()
+        self.addCleanup(token_provider.invalidate)
+
+    def start_server(self, **options):
+        # 55 tracks per album take two album tracks pages of ALBUM_TRACKS_PAGE_LIMIT
+        server = FakeSpotifyServer(FakeCatalog(albums=3, tracks_per_album=55, artists=6), retry_after=0, **options).start()
+        self.addCleanup(server.stop)
+        urls = override_settings(SPOTIFY_BASE_URL=server.api_url, SPOTIFY_AUTH_URL=server.auth_url)
+        urls.enable()
+        self.addCleanup(urls.disable)
+        return server
+
+    def ingest(self):
+        headers = token_provider.get_headers()
+        page = AlbumService.fetch_new_releases(3, 0, headers)
+        return AlbumService.fetch_albums_from_api(page, headers)
+
+    def stored_counts(self):
+        return (Album.objects.count(), SongTrack.objects.count(), Artist.objects.count(),
+                Album.tracks.through.objects.count(), SongTrack.track_artists.through.objects.count(),
+                SongTrack.track_genres.through.objects.count())
+
+    def test_ingests_every_album_track_page(self):
+        server = self.start_server()
+        albums = self.ingest()
+
+        self.assertEqual([album["id"] for album in albums], ["album0000000", "album0000001", "album0000002"])
+        self.assertEqual(SongTrack.objects.count(), 165)
+        self.assertEqual(Album.tracks.through.objects.filter(album_id="album0000001").count(), 55)
+        self.assertEqual(server.calls["album_tracks"], 6)
+        # the six artists of the page are fetched in a single batch
+        self.assertEqual(server.calls["artists"], 1)
+        self.assertEqual(Artist.objects.count(), 6)
+        self.assertTrue(SongTrack.track_genres.through.objects.exists())
+
+    def test_artist_batch_failing_after_retries_raises(self):
+        server = self.start_server()
+        headers = token_provider.get_headers()
+        server.scripted.extend([503] * (spotify_client.max_retries + 1))
+        with self.assertRaises(ThirdPartyError):
+            AlbumService.fetch_artist_batch(["artist0000000"], headers)
+
+    def test_retries_throttled_and_failing_requests(self):
+        server = self.start_server(script=[429, 500, 503])
+        self.ingest()
+
+        self.assertEqual(SongTrack.objects.count(), 165)
+        # token, new releases, 6 album tracks pages and 1 artist batch, plus the 3 retried failures
+        self.assertEqual(sum(server.calls.values()), 12)
+
+    def test_reingesting_is_idempotent(self):
+        self.start_server()
+        self.ingest()
+        counts = self.stored_counts()
+
+        self.ingest()
+        self.assertEqual(self.stored_counts(), counts)
+
+
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def stored_files(self):
+        return sum(len(names) for _, _, names in os.walk(self.directory))
+
+    def test_stale_entries_are_revalidated_with_their_etag(self):
+        server = FakeSpotifyServer(FakeCatalog(albums=1, artists=3)).start()
+        self.addCleanup(server.stop)
+        client = SpotifyClient(base_url=server.api_url, cache_dir=None)
+        client.cache = ResponseCache(self.directory, default_ttl=60)
+        url, querystring = server.api_url + "artists", {"ids": "artist0000001"}
+
+        body = client.get(url, {}, querystring).json()
+        self.assertEqual(client.get(url, {}, querystring).json(), body)
+        self.assertEqual(server.calls["artists"], 1)
+
+        # once stale the entry is sent back as If-None-Match and the 304 serves it for another ttl
+        key = client.cache.key("artists", querystring)
+        client.cache.touch(key, client.cache.load(key), 0)
+        response = client.get(url, {}, querystring)
+        self.assertEqual((response.status_code, response.json()), (200, body))
+        self.assertEqual((server.calls["artists"], server.not_modified), (2, 1))
+        self.assertTrue(client.cache.is_fresh(client.cache.load(key)))
+
+    def test_documents_expire_with_their_ttl(self):
+        response_cache = ResponseCache(self.directory, ttls={"artists/": 60}, prune_every=0)
+        response_cache.set_document("artists", "artist1", {"name": "Artist 1"})
+        self.assertEqual(response_cache.get_document("artists", "artist1"), {"name": "Artist 1"})
+
+        later = time.time() + 61
+        with mock.patch("musicapp.http_cache.time.time", return_value=later):
+            self.assertIsNone(response_cache.get_document("artists", "artist1"))
+        self.assertEqual(response_cache.prune(now=later), 1)
+        self.assertEqual(self.stored_files(), 0)
+
+    def test_concurrent_stores_are_all_counted(self):
+        response_cache = ResponseCache(self.directory, default_ttl=60, prune_every=0)
+
+        def store(number):
+            response_cache.set_document("artists", str(number), {"number": number})
+
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(store, range(400)))
+        self.assertEqual((response_cache.stores, self.stored_files()), (400, 400))
+
+    def test_due_prune_runs_in_the_background(self):
+        response_cache = ResponseCache(self.directory, default_ttl=60, max_bytes=0, prune_every=2)
+        response_cache.set_document("artists", "artist1", {})
+        self.assertIsNone(response_cache.pruner)
+
+        response_cache.set_document("artists", "artist2", {})
+        pruner = response_cache.pruner
+        # None once the prune is already over
+        if pruner is not None:
+            pruner.join()
+        # max_bytes=0 leaves nothing behind
+        self.assertEqual(self.stored_files(), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FetchTracksCursorTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user, self.client = authenticated_client()
+        for number in range(5):
+            album = Album.objects.create(id="album{}".format(number), name="Album {}".format(number))
+            album.tracks.add(SongTrack.objects.create(id="track{}".format(number), name="Track {}".format(number)))
+
+    def get_page(self, cursor, limit=2):
+        return self.client.get(reverse("fetch-tracks-list"), {"cursor": cursor, "limit": limit})
+
+    def test_walks_every_album_once_in_key_order(self):
+        album_ids, cursor, pages = [], "", 0
+        while True:
+            page = self.get_page(cursor).json()
+            album_ids += [album["id"] for album in page["results"]]
+            self.assertTrue(all(len(album["tracks"]) == 1 for album in page["results"]))
+            pages += 1
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(album_ids, ["album{}".format(number) for number in range(5)])
+
+    def test_rejects_invalid_cursor_and_limit(self):
+        self.assertEqual(self.get_page("not-a-cursor").status_code, 400)
+        self.assertEqual(self.get_page("", limit=0).status_code, 400)
+        # well formed cursors holding something other than an album id
+        for position in (5, ["a"], {"id": "a"}, None):
+            response = self.get_page(encode_cursor(position))
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("Invalid cursor", response.json()["message"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TrackSearchTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user, self.client = authenticated_client()
+        self.save_album("Abbey Road")
+        CatalogWriter.save_tracks({"album1": [{"id": "track1", "name": "Beatles Medley", "duration_ms": 1000,
+                                               "artists": ["The Beatles"], "genres": ["rock"], "artist_ids": []}]})
+
+    def save_album(self, name):
+        CatalogWriter.save_albums([{"id": "album1", "album_type": "album", "name": name, "release_date": "1969-09-26",
+                                    "artists": ["The Beatles"], "total_tracks": 1, "external_urls": ""}])
+
+    def search(self, text):
+        response = self.client.get(reverse("search-songs-list"), {"search": text})
+        return [track["id"] for track in response.json()["results"]]
+
+    def test_last_word_matches_as_prefix(self):
+        self.assertEqual(self.search("beatl"), ["track1"])
+        self.assertEqual(self.search("abbey ro"), ["track1"])
+        self.assertEqual(self.search("medley beatles"), ["track1"])
+        self.assertEqual(self.search("beatl medley"), [])
+
+    def test_album_rename_refreshes_track_vectors(self):
+        self.save_album("Let It Be")
+        self.assertEqual(self.search("let it"), ["track1"])
+        self.assertEqual(self.search("abbey"), [])
+
+    def test_similar_lists_ranked_tracks_and_reports_errors(self):
+        CatalogWriter.save_tracks({"album1": [{"id": "track2", "name": "Come Together", "duration_ms": 1000,
+                                               "artists": ["The Beatles"], "genres": ["rock"], "artist_ids": []}]})
+        SimilarTrack.objects.create(track_id="track1", similar_id="track2", rank=0, score=0.9)
+        url = reverse("search-songs-similar", args=["track1"])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(track["id"], track["score"]) for track in response.json()["data"]], [("track2", 0.9)])
+
+        with mock.patch.object(SimilarTrack.objects, "filter", side_effect=DatabaseError("gone")):
+            response = self.client.get(url)
+        self.assertEqual((response.status_code, response.json()["status"]), (400, False))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TypeaheadIndexTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user, _ = authenticated_client()
+        self.tracks = [SongTrack.objects.create(id="track{}".format(index), name=name)
+                        for index, name in enumerate(["Love Song", "Lovely Day", "Loud"])]
+        self.index = PrefixIndex()
+        self.index.refresh()
+
+    def lookup(self, prefix):
+        return [entry["id"] for entry in self.index.lookup(prefix)]
+
+    def test_rename_drops_old_keys(self):
+        SongTrack.objects.filter(id="track1").update(name="Happy Day")
+        self.index.apply({"tracks": ["track1"]})
+        self.assertEqual(self.lookup("lovely"), [])
+        self.assertEqual(self.lookup("happy"), ["track1"])
+        self.assertEqual(self.lookup("day"), ["track1"])
+
+    def test_playlist_membership_reorders(self):
+        playlist = PlayList.objects.create(user=self.user, playlist_name="Mix")
+        PlaylistService.add_tracks(playlist, ["track2"])
+        self.index.reweigh(["track2"])
+        self.assertEqual(self.lookup("lo")[0], "track2")
+
+        PlaylistService.remove_tracks(playlist, ["track2"])
+        PlaylistService.add_tracks(playlist, ["track0"])
+        self.index.reweigh(["track0", "track2"])
+        self.assertEqual(self.lookup("lo")[0], "track0")
+
+    def test_refresh_follows_the_weights_channel(self):
+        playlist = PlayList.objects.create(user=self.user, playlist_name="Mix")
+        PlaylistService.add_tracks(playlist, ["track1"])
+        version = CatalogCache.get_version()
+        CatalogCache.bump_weights(["track1"])
+
+        snapshot = self.index.snapshot
+        self.index.refresh()
+        self.assertEqual(CatalogCache.get_version(), version)
+        self.assertEqual(self.lookup("lo")[0], "track1")
+        # readers of the previous snapshot still see the previous ranking
+        self.assertNotEqual(snapshot.lookup("lo")[0]["id"], "track1")
+
+
+class SpellingTreeTest(TestCase):
+
+    def setUp(self):
+        generator = random.Random(7)
+        self.vocabulary = sorted({"".join(generator.choice("abcdefghijklmnop") for _ in range(generator.randrange(4, 10)))
+                                    for _ in range(2000)})
+        self.tree = BKTree(SPELLING_MAX_DISTANCE)
+        for term in self.vocabulary:
+            self.tree.add(term)
+
+    def test_search_matches_a_full_scan(self):
+        for term in self.vocabulary[::40] + ["abcdefghij", "ponm"]:
+            for max_distance in (1, SPELLING_MAX_DISTANCE):
+                matches, _ = self.tree.walk(term, max_distance)
+                expected = [(levenshtein(term, other), other) for other in self.vocabulary]
+                self.assertEqual(sorted(matches), sorted(match for match in expected if match[0] <= max_distance))
+
+    def test_search_skips_subtrees(self):
+        for term in self.vocabulary[::40]:
+            _, visited = self.tree.walk(term, 1)
+            self.assertLess(visited, len(self.vocabulary) // 2)
+
+
+class SpellingIndexTest(TestCase):
+
+    def setUp(self):
+        SongTrack.objects.create(id="track1", name="Yellow Submarine")
+        SongTrack.objects.create(id="track2", name="Submarine Dreams")
+        self.index = SpellingIndex()
+        self.index.rebuild()
+
+    def test_changes_recount_the_affected_terms(self):
+        SongTrack.objects.filter(id="track1").update(name="Octopus Garden")
+        self.index.apply({"tracks": ["track1"]})
+        self.assertEqual(self.index.frequency["submarine"], 1)
+        self.assertEqual(self.index.suggest("garde"), ["garden"])
+        self.assertEqual(self.index.suggest("yelow"), [])
+
+        SongTrack.objects.filter(id="track2").delete()
+        self.index.apply({"tracks": ["track2"]})
+        self.assertNotIn("submarine", self.index.frequency)
+        self.assertEqual(self.index.suggest("submarin"), [])
+
+        SongTrack.objects.create(id="track3", name="Submarine")
+        self.index.apply({"tracks": ["track3"]})
+        self.assertEqual(self.index.suggest("submarin"), ["submarine"])
+
+
+class SuggestionIndexTest(TestCase):
+
+    def setUp(self):
+        self.rock, self.jazz = Genre.objects.create(name="rock"), Genre.objects.create(name="jazz")
+        self.tracks = [SongTrack.objects.create(id="track{}".format(index), name="Track {}".format(index))
+                        for index in range(3)]
+        for track in self.tracks:
+            track.track_genres.add(self.rock)
+        self.index = SuggestionIndex()
+        self.index.rebuild()
+
+    def test_relinked_track_replaces_its_links(self):
+        first = self.tracks[0]
+        first.track_genres.set([self.jazz])
+        self.index.apply({"tracks": [first.id]})
+        self.assertNotIn(self.index.positions[first.id], self.index.postings["genre"][self.rock.id])
+        self.assertEqual(list(self.index.postings["genre"][self.jazz.id]), [self.index.positions[first.id]])
+
+        first.track_genres.set([self.rock])
+        self.index.apply({"tracks": [first.id]})
+        self.assertNotIn(self.jazz.id, self.index.postings["genre"])
+        positions = list(self.index.postings["genre"][self.rock.id])
+        self.assertEqual(positions, sorted(positions))
+        self.assertEqual(len(positions), 3)
+
+    def test_reweigh_reorders_posting_lists(self):
+        user, _ = authenticated_client()
+        playlist = PlayList.objects.create(user=user, playlist_name="Mix")
+        last = self.index.track_ids[-1]
+        PlaylistService.add_tracks(playlist, [last])
+        self.index.reweigh([last])
+        self.assertEqual(self.index.track_ids[self.index.postings["genre"][self.rock.id][0]], last)
+
+
+class FacetSamplingTest(TestCase):
+
+    def setUp(self):
+        self.genre = Genre.objects.create(name="rock")
+        self.genre.tracks.add(*[SongTrack.objects.create(id="track{:02}".format(index), name="Track {}".format(index))
+                                for index in range(30)])
+        self.facet = CatalogFacet.objects.create(id="genre:{}".format(self.genre.id), kind=CatalogFacet.GENRE,
+                                                 object_id=str(self.genre.id), track_count=30)
+
+    def test_random_facet_skips_kinds_without_facets(self):
+        for _ in range(10):
+            facet, name = FacetService.random_facet()
+            self.assertEqual((facet.pk, name), (self.facet.pk, "rock"))
+
+    def test_sample_wraps_around_the_pivot(self):
+        for _ in range(10):
+            track_ids = [track["id"] for track in FacetService.sample_tracks(self.facet, limit=12)]
+            self.assertEqual(len(set(track_ids)), 12)
+        self.assertEqual(len(FacetService.sample_tracks(self.facet, limit=50)), 30)
+        self.assertEqual(FacetService.sample_tracks(CatalogFacet(kind=CatalogFacet.ARTIST, object_id="missing")), [])
+
+
+# transactional so a second connection can hold row locks while the queue claims
+class IngestionQueueTest(TransactionTestCase):
+
+    def enqueue(self, album_id):
+        return IngestionQueue.enqueue(IngestionJob.ALBUM_TRACKS, {"album_id": album_id}, unique=True)
+
+    def test_unique_enqueue_reuses_the_waiting_job(self):
+        job = self.enqueue("a")
+        self.assertEqual(self.enqueue("a").pk, job.pk)
+        self.assertNotEqual(self.enqueue("b").pk, job.pk)
+
+        IngestionQueue.complete(IngestionQueue.claim("worker"))
+        self.assertNotEqual(self.enqueue("a").pk, job.pk)
+
+    def test_claim_skips_jobs_locked_by_another_worker(self):
+        first, second = self.enqueue("a"), self.enqueue("b")
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    list(IngestionJob.objects.select_for_update().filter(pk=first.pk))
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            self.assertEqual(IngestionQueue.claim("worker").pk, second.pk)
+            self.assertIsNone(IngestionQueue.claim("worker"))
+        finally:
+            release.set()
+            holder.join()
+        self.assertEqual(IngestionQueue.claim("worker").pk, first.pk)
+
+    def test_stale_lease_is_reclaimed_and_the_old_worker_is_ignored(self):
+        self.enqueue("a")
+        job = IngestionQueue.claim("old")
+        self.assertIsNone(IngestionQueue.claim("new"))
+
+        IngestionJob.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(days=1))
+        reclaimed = IngestionQueue.claim("new")
+        self.assertEqual((reclaimed.pk, reclaimed.attempts), (job.pk, 2))
+
+        self.assertFalse(IngestionQueue.heartbeat(job, "old"))
+        self.assertFalse(IngestionQueue.complete(job))
+        self.assertFalse(IngestionQueue.fail(job, "late"))
+        stored = IngestionJob.objects.get(pk=job.pk)
+        self.assertEqual((stored.status, stored.locked_by, stored.last_error),
+                         (IngestionJob.RUNNING, "new", None))
+
+        self.assertTrue(IngestionQueue.complete(reclaimed))
+        self.assertEqual(IngestionJob.objects.get(pk=job.pk).status, IngestionJob.DONE)
+
+    def test_failed_job_is_retried_with_backoff_until_out_of_attempts(self):
+        job = self.enqueue("a")
+        IngestionJob.objects.filter(pk=job.pk).update(max_attempts=2)
+
+        self.assertTrue(IngestionQueue.fail(IngestionQueue.claim("worker"), "boom"))
+        stored = IngestionJob.objects.get(pk=job.pk)
+        self.assertEqual((stored.status, stored.attempts, stored.locked_by), (IngestionJob.PENDING, 1, None))
+        self.assertGreater(stored.run_after, timezone.now())
+        # not runnable before its delay is over
+        self.assertIsNone(IngestionQueue.claim("worker"))
+
+        IngestionJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertTrue(IngestionQueue.fail(IngestionQueue.claim("worker"), "boom again"))
+        stored = IngestionJob.objects.get(pk=job.pk)
+        self.assertEqual((stored.status, stored.attempts, stored.last_error), (IngestionJob.FAILED, 2, "boom again"))
+        self.assertIsNone(IngestionQueue.claim("worker"))
+
+
+class RecommenderTest(TestCase):
+    # users 0-3 like tracks 0-2 and dislike 3-5, users 4-7 the other way round, every fourth pair is left unrated
+    USERS, TRACKS = 8, 6
+
+    def taste(self, user, track):
+        return 5.0 if (user < 4) == (track < 3) else 1.0
+
+    def rated_pairs(self):
+        return [(user, track) for user in range(self.USERS) for track in range(self.TRACKS) if (user + track) % 4]
+
+    def test_als_predicts_the_unrated_pairs(self):
+        pairs = self.rated_pairs()
+        ratings = sp.csr_matrix(([self.taste(user, track) for user, track in pairs], list(zip(*pairs))),
+                                shape=(self.USERS, self.TRACKS))
+        model = ALSModel(factors=2).fit(ratings)
+
+        predicted = model.user_factors @ model.item_factors.T + model.global_mean
+        for user in range(self.USERS):
+            for track in range(self.TRACKS):
+                self.assertAlmostEqual(predicted[user, track], self.taste(user, track), delta=0.5)
+        # user 0 rated tracks 1, 2, 3 and 5
+        self.assertEqual([index for index, _ in top_items(model.item_factors, model.user_factors[0], [1, 2, 3, 5],
+                                                          limit=10, global_mean=model.global_mean)], [0, 4])
+
+    def test_recommend_serves_the_stored_model(self):
+        users = [User.objects.create_user("listener{}@example.com".format(index), "password",
+                                          user_name="listener{}".format(index), first_name="Test", last_name="Listener")
+                 for index in range(self.USERS)]
+        tracks = [SongTrack.objects.create(id="track{}".format(index), name="Track {}".format(index))
+                  for index in range(self.TRACKS)]
+        UserRatings.objects.bulk_create(UserRatings(user=users[user], song_track=tracks[track],
+                                                    rating=self.taste(user, track))
+                                        for user, track in self.rated_pairs())
+
+        first = RecommenderTrainer(factors=2).run(log=lambda message: None)
+        self.assertEqual(UserFactor.objects.filter(model=first).count(), self.USERS)
+
+        recommender = Recommender.current()
+        self.assertEqual(recommender.uid, first.uid)
+        recommended = recommender.recommend(users[0])
+        self.assertEqual([track_id for track_id, _ in recommended], ["track0", "track4"])
+        self.assertAlmostEqual(recommended[0][1], 5.0, delta=0.5)
+        self.assertEqual(recommender.recommend(User(user_name="unknown")), [])
+
+        # retraining replaces the stored model and the next request loads it
+        second = RecommenderTrainer(factors=2).run(log=lambda message: None)
+        self.assertEqual(list(RecommenderModel.objects.values_list("uid", flat=True)), [second.uid])
+        self.assertEqual(Recommender.current().uid, second.uid)
@@ -13,5 +13,7 @@ urlpatterns = [
     path('', include(router.urls)),
     path('recommend-songs', RecommendSongs.as_view(), name="recommend-songs"),
     path('autosuggest-songs', AutoSuggest.as_view(), name="autosuggest-songs"),
-    path('auto-playlist', AutoGeneratePlaylist.as_view(), name="auto-playlist")
+    path('auto-playlist', AutoGeneratePlaylist.as_view(), name="auto-playlist"),
+    path('autocomplete', Autocomplete.as_view(), name="autocomplete"),
+    path('recommended-songs', RecommendedSongs.as_view(), name="recommended-songs")
 ]
\ No newline at end of file
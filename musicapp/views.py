@@ -3,15 +3,15 @@ from .exceptions import *
 from base.utils import *
 from .services import *
 from .serializers import *
+from .cache import CatalogCache
+from .filters import TrackFullTextSearchFilter, TrackRelationFilter
+from .indexes import PrefixIndex, SpellingIndex, SuggestionIndex
+from .recommender import Recommender
 
 # django imports
-import random
 from django.core.paginator import Paginator
 from django.db import transaction
-from django.http import JsonResponse
-from django.db.models import Q
-from operator import or_
-from functools import reduce
+from django.http import HttpResponse, JsonResponse
 from rest_framework import generics
 
 # rest_framework imports
@@ -39,14 +39,42 @@ class AlbumList(BaseAPIViewSet):
                 return Response(responsedata(False, "You are not authorized"), status=status.HTTP_401_UNAUTHORIZED)
             params = request.GET
             limit = int(params.get('limit', 20))
+
+            # rendered pages stay cached until ingestion writes one of their albums or adds new albums,
+            # on a miss the catalog stamp is read before rendering
+
+            # cursor mode serves stored albums by keyset, an empty cursor asks for the first page
+            if 'cursor' in params:
+                if limit < 1 or limit > MAX_CURSOR_LIMIT:
+                    return Response(responsedata(False, CURSOR_LIMIT_ERR), status=status.HTTP_400_BAD_REQUEST)
+                cache_key = CatalogCache.page_key('fetch-tracks', limit=limit, cursor=params.get('cursor'))
+                cached_page = CatalogCache.get_page(cache_key)
+                if cached_page is not None:
+                    return HttpResponse(cached_page, content_type='application/json')
+                stamp = CatalogCache.page_stamp()
+
+                page = AlbumService.get_songs_page(limit, params.get('cursor'))
+                response = JsonResponse(page, safe=False)
+                CatalogCache.set_page(cache_key, response.content, [album["id"] for album in page["results"]], stamp)
+                return response
+
             offset = int(params.get('offset', 0))
+            cache_key = CatalogCache.page_key('fetch-tracks', limit=limit, offset=offset)
+            cached_page = CatalogCache.get_page(cache_key)
+            if cached_page is not None:
+                return HttpResponse(cached_page, content_type='application/json')
+            stamp = CatalogCache.page_stamp()
+
             if offset and Album.objects.all().count() > offset:
                 return Response(responsedata(False, PAGINATION_ERR),\
                     status=status.HTTP_400_BAD_REQUEST)
             res_albums =  AlbumService.get_songs_list(limit, offset)
 
             # Paginated response          
-            return JsonResponse(res_albums, safe=False)
+            response = JsonResponse(res_albums, safe=False)
+            if res_albums:
+                CatalogCache.set_page(cache_key, response.content, [album["id"] for album in res_albums], stamp)
+            return response
 
         except (ValidationError, ThirdPartyError, APIException) as e:
             return Response(responsedata(False, str(e)), status=status.HTTP_400_BAD_REQUEST)
@@ -77,23 +105,24 @@ class PlaylistAction(BaseAPIViewSet):
         if not (request.user.is_authenticated):
             return Response(responsedata(False, "You are not authorized"), status=status.HTTP_401_UNAUTHORIZED)
 
-        playlist_map = {}
         queryset = self.filter_queryset(self.get_queryset()).filter(user=request.user)
         pagenumber = request.GET.get('page', 1)
         paginator = Paginator(queryset, 10)
 
-        playlist_qs = paginator.page(pagenumber).object_list
-        response = list(playlist_qs.values())
-
-        for playlist in playlist_qs:
-            playlist_map[playlist.pk] = playlist
+        response = list(paginator.page(pagenumber).object_list.values())
 
-        # Custom response creation
+        # Custom response creation, a bounded first slice of tracks per playlist from a single windowed query,
+        # the rest is served by the playlist tracks endpoint from tracks_cursor
+        payload = SideLoadedPayload() if is_compact(request) else None
+        previews = PlaylistService.track_previews({res.get("uid"): res.get("track_count") for res in response}, payload=payload)
         for res in response:
-            res.update({"tracks": list(playlist_map[res.get("uid")].tracks.values('id', 'name', 'duration_ms', 'artists', 'genres', 'external_urls', 'album__name'))})
+            res.update(previews[res.get("uid")])
 
-        # Paginated response
-        return JsonResponse(paginate(response, paginator, pagenumber), safe=False)
+        # Paginated response, compact responses carry track ids and every track and album once in `included`
+        res_data = paginate(response, paginator, pagenumber)
+        if payload is not None:
+            res_data.update(included=payload.included())
+        return JsonResponse(res_data, safe=False)
 
 
     def create(self, request):
@@ -106,10 +135,7 @@ class PlaylistAction(BaseAPIViewSet):
             playlist_info = request.data
 
             if playlist_info.get("tracks"):
-                songs_list = list(set(playlist_info.pop("tracks")))
-                songs_qs = SongTrack.objects.filter(id__in=songs_list).count()
-                if songs_qs != len(songs_list):
-                    raise PlaylistException("Please add songs by their valid ids, incorrect id in songs list")
+                songs_list = PlaylistService.validate_tracks(playlist_info.pop("tracks"))
             else:
                 return Response(responsedata(False, "Please add songs for the playlist"),status=status.HTTP_400_BAD_REQUEST)
 
@@ -123,10 +149,10 @@ class PlaylistAction(BaseAPIViewSet):
             with transaction.atomic():
                 if playlist_serializer.is_valid(raise_exception=True):
                     playlist = playlist_serializer.save(user=request.user)
-                    playlist.tracks.add(*songs_list)
+                    PlaylistService.add_tracks(playlist, songs_list)
 
                     res_data = playlist_serializer.data
-                    res_data.update(user=user_data, tracks=list(playlist.tracks.values()))
+                    res_data.update(user=user_data, **PlaylistService.track_previews({playlist.pk: playlist.track_count})[playlist.pk])
 
             return JsonResponse(responsedata(True, "Playlist of songs created for the user", res_data), \
                             status=status.HTTP_202_ACCEPTED)
@@ -148,14 +174,11 @@ class PlaylistAction(BaseAPIViewSet):
             if PlayList.objects.filter(user=request.user, uid=pk).exists():
                 instance = PlayList.objects.get(user=request.user, uid=pk)
             else:
-                return Response(responsedata(False, "No playlist exists correspnding to this id for the user"),\
+                return Response(responsedata(False, PLAYLIST_NOT_FOUND_ERR),\
                                                 status=status.HTTP_400_BAD_REQUEST)    
 
             if playlist_info.get("tracks"):
-                songs_list = list(set(playlist_info.pop("tracks")))
-                songs_qs = SongTrack.objects.filter(id__in=songs_list).count()
-                if songs_qs != len(songs_list):
-                    raise PlaylistException("One or more invalid song ids in songs list")
+                songs_list = PlaylistService.validate_tracks(playlist_info.pop("tracks"))
             else:
                 return Response(responsedata(False, "Please add songs for the playlist"),status=status.HTTP_400_BAD_REQUEST)
             
@@ -168,14 +191,11 @@ class PlaylistAction(BaseAPIViewSet):
             with transaction.atomic():
                 if playlist_serializer.is_valid(raise_exception=True):
                     playlist = playlist_serializer.save(user=request.user)
-
-                    if playlist.tracks.all().exists():
-                        playlist.tracks.clear()
-
-                    playlist.tracks.add(*songs_list)
+                    # only the through rows of the added and removed tracks are written
+                    PlaylistService.set_tracks(playlist, songs_list)
 
                     res_data = playlist_serializer.data
-                    res_data.update(user=user_data, tracks=list(playlist.tracks.values()))
+                    res_data.update(user=user_data, **PlaylistService.track_previews({playlist.pk: playlist.track_count})[playlist.pk])
 
                     return JsonResponse(responsedata(True, "Playlist of songs updated for the user", res_data), \
                                     status=status.HTTP_202_ACCEPTED)
@@ -186,6 +206,108 @@ class PlaylistAction(BaseAPIViewSet):
             return Response(responsedata(False, GENERIC_ERR),status=status.HTTP_400_BAD_REQUEST)
 
 
+    def retrieve(self, request, pk=None):
+        """
+        A playlist of the user with the first tracks, the rest is served by the playlist tracks endpoint
+        """
+        try:
+            # Checking Authorization
+            if not (request.user.is_authenticated):
+                return Response(responsedata(False, "You are not authorized"), status=status.HTTP_401_UNAUTHORIZED)
+
+            playlist = PlayList.objects.filter(user=request.user, uid=pk).first()
+            if playlist is None:
+                return Response(responsedata(False, PLAYLIST_NOT_FOUND_ERR), status=status.HTTP_400_BAD_REQUEST)
+
+            payload = SideLoadedPayload() if is_compact(request) else None
+            res_data = PlayListSerializer(playlist).data
+            res_data.update(PlaylistService.track_previews({playlist.pk: playlist.track_count}, payload=payload)[playlist.pk])
+            if payload is not None:
+                res_data.update(included=payload.included())
+            return JsonResponse(responsedata(True, "Playlist retrieved", res_data), status=status.HTTP_200_OK)
+
+        except Exception:
+            return Response(responsedata(False, GENERIC_ERR),status=status.HTTP_400_BAD_REQUEST)
+
+
+    @action(detail=True, methods=['get'])
+    def tracks(self, request, pk=None, *args, **kwargs):
+        """
+        Keyset paginated tracks of a playlist, continuing from the tracks_cursor of the playlist responses
+        """
+        try:
+            # Checking Authorization
+            if not (request.user.is_authenticated):
+                return Response(responsedata(False, "You are not authorized"), status=status.HTTP_401_UNAUTHORIZED)
+
+            limit = int(request.GET.get('limit', PLAYLIST_TRACKS_PREVIEW))
+            if limit < 1 or limit > MAX_CURSOR_LIMIT:
+                return Response(responsedata(False, CURSOR_LIMIT_ERR), status=status.HTTP_400_BAD_REQUEST)
+
+            playlist = PlayList.objects.filter(user=request.user, uid=pk).first()
+            if playlist is None:
+                return Response(responsedata(False, PLAYLIST_NOT_FOUND_ERR), status=status.HTTP_400_BAD_REQUEST)
+
+            payload = SideLoadedPayload() if is_compact(request) else None
+            res_data = PlaylistService.get_tracks_page(playlist, limit, request.GET.get('cursor'), payload)
+            if payload is not None:
+                res_data.update(included=payload.included())
+            return JsonResponse(res_data, safe=False)
+
+        except ValidationError as e:
+            return Response(responsedata(False, str(e)), status=status.HTTP_400_BAD_REQUEST)
+        except Exception:
+            return Response(responsedata(False, GENERIC_ERR),status=status.HTTP_400_BAD_REQUEST)
+
+
+    def change_tracks(self, request, pk, apply, message):
+        """
+        Apply the tracks delta of the request body to a playlist of the user
+        """
+        try:
+            # Checking Authorization
+            if not (request.user.is_authenticated):
+                return Response(responsedata(False, "You are not authorized"), status=status.HTTP_401_UNAUTHORIZED)
+
+            if not request.data.get("tracks"):
+                return Response(responsedata(False, "Please add songs for the playlist"),status=status.HTTP_400_BAD_REQUEST)
+
+            with transaction.atomic():
+                # row lock so concurrent deltas to the same playlist apply one after the other
+                playlist = PlayList.objects.select_for_update().filter(user=request.user, uid=pk).first()
+                if playlist is None:
+                    return Response(responsedata(False, PLAYLIST_NOT_FOUND_ERR), status=status.HTTP_400_BAD_REQUEST)
+
+                changed = apply(playlist, request.data.get("tracks"))
+
+            return JsonResponse(responsedata(True, message, changed), status=status.HTTP_202_ACCEPTED)
+
+        except PlaylistException as e:
+            return Response(responsedata(False, str(e)),status=status.HTTP_400_BAD_REQUEST)
+        except Exception:
+            return Response(responsedata(False, GENERIC_ERR),status=status.HTTP_400_BAD_REQUEST)
+
+
+    @action(detail=True, methods=['post'], url_path='add-tracks')
+    def add_tracks(self, request, pk=None, *args, **kwargs):
+        """
+        Add songs to a playlist, songs already in it are skipped
+        """
+        return self.change_tracks(request, pk, lambda playlist, tracks: {
+            "added": PlaylistService.add_tracks(playlist, PlaylistService.validate_tracks(tracks))},
+            "Songs added to the playlist")
+
+
+    @action(detail=True, methods=['post'], url_path='remove-tracks')
+    def remove_tracks(self, request, pk=None, *args, **kwargs):
+        """
+        Remove songs from a playlist, songs not in it are ignored
+        """
+        return self.change_tracks(request, pk, lambda playlist, tracks: {
+            "removed": PlaylistService.remove_tracks(playlist, list(dict.fromkeys(tracks)))},
+            "Songs removed from the playlist")
+
+
 # CRUD api for the searching through collection of songs
 class SearchSongs(BaseAPIViewSet):
 
@@ -193,7 +315,7 @@ class SearchSongs(BaseAPIViewSet):
     model_class = SongTrack
     instance_name = 'song_tracks'
     search_fields = ['name', 'genres', 'artists']
-    filter_backends = (filters.SearchFilter,)
+    filter_backends = (TrackRelationFilter, TrackFullTextSearchFilter)
     queryset = SongTrack.objects.all()
 
 
@@ -214,10 +336,44 @@ class SearchSongs(BaseAPIViewSet):
         paginator = Paginator(queryset, 10)
 
         songs_qs = paginator.page(pagenumber).object_list            
-        response = list(songs_qs.values('id', 'name', 'duration_ms', 'artists', 'genres', 'external_urls', 'album__name'))
+        if is_compact(request):
+            # track ids in rank order, every track and album once in `included`
+            payload = SideLoadedPayload()
+            response = payload.add_tracks(songs_qs.values(*TRACK_FIELDS, 'album__id', 'album__name'))
+            res_data = paginate(response, paginator, pagenumber)
+            res_data.update(included=payload.included())
+        else:
+            response = list(songs_qs.values('id', 'name', 'duration_ms', 'artists', 'genres', 'external_urls', 'album__name'))
+            res_data = paginate(response, paginator, pagenumber)
+
+        # few hits for a search usually means a misspelling, offer the closest known terms once the
+        # vocabulary is built, a request never waits for it
+        search = request.GET.get('search', '')
+        if search and paginator.count < SPELLING_MIN_HITS:
+            spelling = SpellingIndex.get()
+            res_data.update(suggestions=spelling.suggest(search) if spelling else [])
 
         # Paginated response
-        return JsonResponse(paginate(response, paginator, pagenumber), safe=False)
+        return JsonResponse(res_data, safe=False)
+
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None, *args, **kwargs):
+        """
+        List the precomputed most similar tracks of a song track
+        """
+        try:
+            if not (request.user.is_authenticated):
+                return Response(responsedata(False, "You are not authorized"), status=status.HTTP_401_UNAUTHORIZED)
+
+            similar_tracks = [{**{field: row["similar__" + field] for field in TRACK_FIELDS}, "score": row["score"]}
+                                for row in SimilarTrack.objects.filter(track_id=pk).order_by("rank")
+                                    .values("score", *["similar__" + field for field in TRACK_FIELDS])]
+
+            return JsonResponse(responsedata(True, "Similar tracks", similar_tracks), status=status.HTTP_200_OK)
+
+        except Exception:
+            return Response(responsedata(False, GENERIC_ERR),status=status.HTTP_400_BAD_REQUEST)
 
   
     @action(detail=False, methods=['post'])
@@ -295,25 +451,25 @@ class AutoSuggest(generics.ListAPIView):
             if not (request.user.is_authenticated):
                 return Response(responsedata(False, "You are not authorized"), status=status.HTTP_401_UNAUTHORIZED)
 
-            queryset = PlayList.objects.filter(user=request.user)
-            
-            genres = list(queryset.values_list("tracks__genres", flat=True))
-            artists = list(queryset.values_list("tracks__artists", flat=True))
-            albums =  list(queryset.values_list("tracks__album__name", flat=True))
-
-            unique_genres = sum([data[0].split(",") for data in genres], [])
+            limit = min(int(request.GET.get("limit", SUGGEST_TOP_N)), SUGGEST_TOP_N)
+            owned_track_ids = PlayList.tracks.through.objects.filter(playlist__user=request.user) \
+                                    .values_list("songtrack_id", flat=True).distinct()
 
-            genre_list = [Q(genres__icontains=x) for x in unique_genres]
+            # nothing to suggest until the index of this worker is built
+            index = SuggestionIndex.get()
+            suggestions = index.suggest(list(owned_track_ids), limit) if index else {facet: [] for facet in SuggestionIndex.FACETS}
 
-            artist_list  = [Q(artists__icontains=x) for x in sum([data for data in artists], [])]
+            def suggested_tracks(facet, *fields):
+                scores = dict(suggestions[facet])
+                tracks = SongTrack.objects.filter(id__in=list(scores)).values("id", *fields)
+                return sorted((dict(track, score=scores[track["id"]]) for track in tracks),
+                                key=lambda track: -track["score"])
 
-            albums_list = [Q(album__name__icontains=x) for x in albums]
+            similar_genre_songs = suggested_tracks("genre", "name", "genres")
 
-            similar_genre_songs = list(SongTrack.objects.filter(Q(reduce(or_, genre_list))).values("name", "genres"))
+            similar_artist_songs = suggested_tracks("artist", "name", "artists")
 
-            similar_artist_songs = list(SongTrack.objects.filter(Q(reduce(or_, artist_list))).values("name", "artists"))
-
-            similar_album_songs = list(SongTrack.objects.filter(Q(reduce(or_, albums_list))).values("name", "album__name"))
+            similar_album_songs = suggested_tracks("album", "name", "album__name")
 
             response.update({"based_on_genre":similar_genre_songs, "based_on_album": similar_album_songs,
                                     "based_on_artist": similar_artist_songs})
@@ -386,26 +542,54 @@ class AutoGeneratePlaylist(generics.ListAPIView):
             if not (request.user.is_authenticated):
                 return Response(responsedata(False, "You are not authorized"), status=status.HTTP_401_UNAUTHORIZED)
 
-            available_genres = SongTrack.objects.all().values_list('genres', flat=True)
-            unique_genres = list(set(sum([data[0].split(",") for data in available_genres], [])))
-            chosen_genre = random.choice(unique_genres)
+            facet, auto_suggest = FacetService.random_facet()
+            tracks_to_add = FacetService.sample_tracks(facet) if facet else []
 
-            available_artists = SongTrack.objects.all().values_list('artists', flat=True)
-            unique_artists = list(set(sum([data[0].split(",") for data in available_artists], []))) 
-            chosen_artists = random.choice(unique_artists)
-            
-            available_albums = list(SongTrack.objects.all().values_list('album__name', flat=True))
-            chosen_album = random.choice(available_albums)
+            return JsonResponse(responsedata(True, "Auto playlist generated for you based on category - {}".format(auto_suggest), tracks_to_add), \
+                            status=status.HTTP_200_OK)                                    
 
-            playlist_choices = [chosen_genre, chosen_artists, chosen_album]
+        except Exception:
+            return Response(responsedata(False, GENERIC_ERR),status=status.HTTP_400_BAD_REQUEST)
 
-            auto_suggest = random.choice(playlist_choices)
 
-            tracks_to_add = list(SongTrack.objects.filter(Q(genres__icontains=auto_suggest)|Q(album__name__icontains=auto_suggest)|\
-                                                Q(artists__icontains=auto_suggest))[:10].values())
+# Api for type-as-you-go suggestions over track, artist and album names
+class Autocomplete(generics.ListAPIView):
 
-            return JsonResponse(responsedata(True, "Auto playlist generated for you based on category - {}".format(auto_suggest), tracks_to_add), \
-                            status=status.HTTP_200_OK)                                    
+    def get(self, request, *args, **kwargs):
+        try:
+            # Checking Authorization
+            if not (request.user.is_authenticated):
+                return Response(responsedata(False, "You are not authorized"), status=status.HTTP_401_UNAUTHORIZED)
+
+            query = request.GET.get("q", "")
+            limit = min(int(request.GET.get("limit", TYPEAHEAD_TOP_K)), TYPEAHEAD_TOP_K)
+            index = PrefixIndex.get()
+            suggestions = index.lookup(query, limit) if index and query.strip() else []
+
+            return JsonResponse(responsedata(True, "Autocomplete suggestions", suggestions), status=status.HTTP_200_OK)
 
         except Exception:
-            return Response(responsedata(False, GENERIC_ERR),status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return Response(responsedata(False, GENERIC_ERR),status=status.HTTP_400_BAD_REQUEST)
+
+
+class RecommendedSongs(generics.ListAPIView):
+
+    def get(self, request, *args, **kwargs):
+        try:
+            # Checking Authorization
+            if not (request.user.is_authenticated):
+                return Response(responsedata(False, "You are not authorized"), status=status.HTTP_401_UNAUTHORIZED)
+
+            limit = min(int(request.GET.get("limit", RECOMMEND_TOP_N)), RECOMMEND_TOP_N)
+            recommender = Recommender.current()
+            predictions = recommender.recommend(request.user, limit) if recommender else []
+
+            rows = {row["id"]: row for row in SongTrack.objects.filter(id__in=[track_id for track_id, _ in predictions])
+                                                                .values(*TRACK_FIELDS)}
+            recommended = [{**rows[track_id], "predicted_rating": round(score, 2)}
+                            for track_id, score in predictions if track_id in rows]
+
+            return JsonResponse(responsedata(True, "Recommended songs", recommended), status=status.HTTP_200_OK)
+
+        except Exception:
+            return Response(responsedata(False, GENERIC_ERR),status=status.HTTP_400_BAD_REQUEST)